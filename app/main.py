@@ -1,21 +1,112 @@
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-from typing import List
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+import asyncio
+import functools
+import io
+import logging
 import os
-from dotenv import load_dotenv, find_dotenv
-from app.modules.analyzer import AnalyticsEngine
+import sys
+from dotenv import load_dotenv
+from app.modules.analyzer import AnalyticsEngine, SummaryAccumulator
+from app.modules.ingest import missing_fields_error, read_csv_stream, read_multipart_csv
 
-# DEBUG: Enhanced environment variable loading
-print("Looking for .env file...")
-env_path = find_dotenv()
-print(f"Found .env at: {env_path}")
+logger = logging.getLogger(__name__)
 
-# Load environment variables
+# Load environment variables (searches up from the working directory)
 load_dotenv()
 
-app = FastAPI()
+# Analyses run off the event loop. Threads rather than processes: the engine
+# holds an OpenAI client that can't be pickled, and its time is spent waiting
+# on the API or inside pandas/NumPy kernels that release the GIL. Most of an
+# analysis is spent waiting on OpenAI, so there are several workers per CPU.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 4 * (os.cpu_count() or 1)))
+ANALYSIS_POOL = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+# Requests being parsed, waiting for a worker or analyzed. Each may hold a
+# whole upload in memory, so past this many new uploads get a 503 before
+# their body is read
+ANALYSIS_CAPACITY = ANALYSIS_WORKERS * 2
+analysis_slots = asyncio.Semaphore(ANALYSIS_CAPACITY)
+
+# Parsed requests wait here for a free worker; the slots bound its length.
+# Created by lifespan, on the loop that serves the requests
+analysis_queue: Optional[asyncio.Queue] = None
+
+async def analysis_worker():
+    """Run queued analyzer calls on the analysis pool, one at a time"""
+    loop = asyncio.get_running_loop()
+    while True:
+        func, kwargs, future = await analysis_queue.get()
+        try:
+            if not future.done():
+                result = await loop.run_in_executor(ANALYSIS_POOL, functools.partial(func, **kwargs))
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            analysis_queue.task_done()
+
+# A few rows in the shape of a real export, used to warm up the parsing and
+# summary code paths at boot
+WARM_UP_CSV = (
+    b"week,customer_id,widget_name,layout,views,clicks,attributed_revenue\n"
+    b"2024-01-01,c1,carousel,grid,\"1,200\",30,45.50\n"
+    b"2024-01-08,c2,stories,list,900,12,20.00\n"
+)
+
+def warm_up():
+    """Run the local analysis paths once so the first request doesn't pay for lazy initialization"""
+    read_csv_stream(io.BytesIO(WARM_UP_CSV), SummaryAccumulator(), SummaryAccumulator.COLUMN_TYPES).finalize()
+    analyzer.warm_up(read_csv_stream(io.BytesIO(WARM_UP_CSV)))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global analysis_queue
+    analysis_queue = asyncio.Queue()
+    try:
+        await asyncio.get_running_loop().run_in_executor(ANALYSIS_POOL, warm_up)
+    except Exception as e:
+        logger.warning("Warm-up failed: %s", e)
+    workers = [asyncio.create_task(analysis_worker()) for _ in range(ANALYSIS_WORKERS)]
+    yield
+    for worker in workers:
+        worker.cancel()
+    ANALYSIS_POOL.shutdown(wait=False)
+
+def busy_response() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many analyses in progress, please retry shortly",
+        headers={"Retry-After": "10"}
+    )
+
+async def capacity_guard():
+    """Hold an analysis slot from before the upload is read until the response
+
+    Uploads are turned away with a 503 while every slot is taken.
+    """
+    if analysis_slots.locked():
+        raise busy_response()
+    await analysis_slots.acquire()
+    try:
+        yield
+    finally:
+        analysis_slots.release()
+
+async def run_analysis(func, **kwargs):
+    """Queue an analyzer call and wait for a worker to run it"""
+    future = asyncio.get_running_loop().create_future()
+    analysis_queue.put_nowait((func, kwargs, future))
+    return await future
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 origins = [
@@ -34,21 +125,74 @@ app.add_middleware(
 # Initialize analyzer
 analyzer = AnalyticsEngine()
 
-@app.post("/analyze")
-async def analyze_data(
-    file: UploadFile = File(...),
-    business_model: str = Form(...),
-    value_proposition: str = Form(...),
-    target_metrics: str = Form(...),
-    revenue_drivers: str = Form(...)
-):
+# Largest request body accepted by the upload endpoints
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 256 << 20))
+
+def size_guard(request: Request):
+    """Reject uploads whose declared size exceeds MAX_UPLOAD_BYTES before reading the body"""
     try:
-        # Read CSV file
-        df = pd.read_csv(file.file)
-        
-        # Clean column names by stripping whitespace
-        df.columns = df.columns.str.strip()
-        print("CSV columns after cleaning:", df.columns.tolist())
+        content_length = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+
+class ResultCache:
+    """Small LRU cache of successful analysis results"""
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: Hashable, result: Dict):
+        if not result.get("success"):
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+# Re-uploads of the same file with the same inputs (e.g. a UI retry) are
+# answered without re-running the analysis
+result_cache = ResultCache()
+
+def split_names(value: str) -> Tuple[str, ...]:
+    """Split a comma-separated form value into stripped, interned names"""
+    return tuple(sys.intern(name.strip()) for name in value.split(',') if name.strip())
+
+def require_fields(form: Dict[str, Optional[str]], names: Iterable[str]):
+    """Raise FastAPI's 422 if any required form field is missing or empty"""
+    missing = [name for name in names if not form.get(name)]
+    if missing:
+        raise missing_fields_error(missing)
+
+@app.post("/analyze", dependencies=[Depends(size_guard), Depends(capacity_guard)])
+async def analyze_data(request: Request):
+    fields = ['business_model', 'value_proposition', 'target_metrics', 'revenue_drivers']
+    try:
+        # Summarize the CSV batch by batch while the upload streams in, so
+        # the full table is never held in memory
+        summary, form, digest = await read_multipart_csv(
+            request, fields, SummaryAccumulator(), max_bytes=MAX_UPLOAD_BYTES,
+            column_types=SummaryAccumulator.COLUMN_TYPES, columns=SummaryAccumulator.COLUMNS
+        )
+        require_fields(form, fields)
+        logger.debug("CSV columns after cleaning: %s", summary.columns)
+
+        target_metrics = split_names(form['target_metrics'])
+        revenue_drivers = split_names(form['revenue_drivers'])
+
+        cache_key = ('analyze', digest, form['business_model'], form['value_proposition'],
+                     target_metrics, revenue_drivers)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # if 'week' not in df.columns:
         #     return {
@@ -57,53 +201,59 @@ async def analyze_data(
         #     }
 
         # Process the analysis
-        result = analyzer.analyze_data(
-            df=df,
-            business_model=business_model,
-            value_proposition=value_proposition,
-            target_metrics=target_metrics.split(','),
-            revenue_drivers=revenue_drivers.split(',')
+        result = await run_analysis(
+            analyzer.analyze_summary,
+            summary=summary,
+            business_model=form['business_model'],
+            value_proposition=form['value_proposition'],
+            target_metrics=target_metrics,
+            revenue_drivers=revenue_drivers
         )
+        result_cache.put(cache_key, result)
         
         return result
     
+    except (HTTPException, RequestValidationError):
+        raise
     except Exception as e:
-        print(f"Detailed error in analyze_data: {str(e)}")
+        logger.error("Detailed error in analyze_data: %s", e)
         return {
             "success": False,
             "error": f"Error processing data: {str(e)}"
         }
     
 
-@app.post("/analyze-dynamic")
-def analyze_data_dynamic(
-    file: UploadFile = File(...),
-    business_model: str = Form(...),
-    value_proposition: str = Form(...),
-    business_goal: Optional[str] = Form(None),
-    questions: Optional[str] = Form(None)
-):
+@app.post("/analyze-dynamic", dependencies=[Depends(size_guard), Depends(capacity_guard)])
+async def analyze_data_dynamic(request: Request):
     try:
-        # Read CSV file
-        df = pd.read_csv(file.file)
-        
-        # Clean column names by stripping whitespace
-        df.columns = df.columns.str.strip()
-        print("CSV columns after cleaning:", df.columns.tolist())
+        # Read CSV file while the upload streams in
+        fields = ['business_model', 'value_proposition', 'business_goal', 'questions']
+        table, form, digest = await read_multipart_csv(request, fields, max_bytes=MAX_UPLOAD_BYTES)
+        require_fields(form, ['business_model', 'value_proposition'])
+        logger.debug("CSV columns after cleaning: %s", table.column_names)
+
+        cache_key = ('analyze-dynamic', digest) + tuple(form[name] for name in fields)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # Process the analysis
-        result = analyzer.analyze_data_dynamic(
-            df=df,
-            business_model=business_model,
-            value_proposition=value_proposition,
-            business_goal=business_goal,
-            questions=questions
+        result = await run_analysis(
+            analyzer.analyze_data_dynamic,
+            df=table,
+            business_model=form['business_model'],
+            value_proposition=form['value_proposition'],
+            business_goal=form['business_goal'],
+            questions=form['questions']
         )
+        result_cache.put(cache_key, result)
         
         return result
     
+    except (HTTPException, RequestValidationError):
+        raise
     except Exception as e:
-        print(f"Detailed error in analyze_data_dynamic: {str(e)}")
+        logger.error("Detailed error in analyze_data_dynamic: %s", e)
         return {
             "success": False,
             "error": f"Error processing data: {str(e)}"
@@ -1,20 +1,54 @@
-from typing import Dict, List
+from typing import Dict, List, Sequence
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from openai import OpenAI
 from datetime import datetime
 import os
 import yaml
 import json
+import logging
 import ast
-from typing import Tuple, Set, Any
+import re
+import functools
+from typing import Tuple, Set, Any, FrozenSet, Optional
+from types import CodeType
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'prompts.yaml')
+
+# libyaml's loader parses several times faster than the pure-Python one
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Parsed prompt files keyed by path, with the (mtime, size) they were parsed at
+_prompts_cache: Dict[str, Tuple[Tuple[float, int], Dict]] = {}
+
+def load_prompts(path: str = PROMPTS_PATH) -> Dict:
+    """Load the prompts YAML, parsing it again only when the file has changed"""
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+    cached = _prompts_cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with open(path, 'r') as file:
+        prompts = yaml.load(file, Loader=_YamlLoader)
+    _prompts_cache[path] = (version, prompts)
+    return prompts
 
 class CodeValidator:
     """Validates and sanitizes code generated by GPT"""
+
+    # Every construct _find_unsafe_operations rejects needs one of these words
+    UNSAFE_WORDS = re.compile(r'\b(?:import|def|class|eval|exec|open|system|os)\b')
     
     @classmethod
+    @functools.lru_cache(maxsize=512)
     def validate_code(cls, code: str) -> Tuple[bool, str, str]:
-        """Validates and sanitizes code"""
+        """Validates and sanitizes code; verdicts are cached, rejections included"""
         try:
             # Clean up the code first
             code = cls._clean_complex_expressions(code)
@@ -22,8 +56,12 @@ class CodeValidator:
             # Parse the code into an AST to verify syntax
             tree = ast.parse(code)
             
-            # Check for unsafe operations
-            unsafe_ops = cls._find_unsafe_operations(tree)
+            # Check for unsafe operations. The tree only needs walking when one of
+            # the words appears; non-ASCII code is always walked since identifiers
+            # are NFKC-normalized and could spell them with other characters
+            unsafe_ops = None
+            if not code.isascii() or cls.UNSAFE_WORDS.search(code):
+                unsafe_ops = cls._find_unsafe_operations(tree)
             if unsafe_ops:
                 return False, "", f"Unsafe operations found: {', '.join(unsafe_ops)}"
             
@@ -96,6 +134,54 @@ class CodeValidator:
         
         return final_code
 
+    @classmethod
+    def names_used(cls, code: str) -> Tuple[Set[str], Set[str]]:
+        """Names the code reads and writes; in-place changes to df count as writing df"""
+        tree = ast.parse(code)
+        loads, stores, mutated, aliases = set(), set(), set(), {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                (loads if isinstance(node.ctx, ast.Load) else stores).add(node.id)
+            elif isinstance(node, (ast.Subscript, ast.Attribute)) and not isinstance(node.ctx, ast.Load):
+                # df['col'] = ..., df.loc[...] = ..., del df['col']
+                mutated.add(cls._base_name(node.value))
+            elif isinstance(node, ast.Call):
+                inplace = any(kw.arg == 'inplace' for kw in node.keywords)
+                mutating = isinstance(node.func, ast.Attribute) and node.func.attr in {'insert', 'pop', 'update'}
+                if inplace or mutating:
+                    mutated.add(cls._base_name(node.func))
+            elif isinstance(node, ast.Assign):
+                # d = df binds the same object, so changing d changes df
+                for target in node.targets:
+                    pairs = [(target, node.value)]
+                    if isinstance(target, ast.Tuple) and isinstance(node.value, ast.Tuple):
+                        pairs = zip(target.elts, node.value.elts)
+                    for name, value in pairs:
+                        if isinstance(name, ast.Name) and isinstance(value, ast.Name):
+                            aliases.setdefault(name.id, set()).add(value.id)
+        pending = [name for name in mutated if name is not None]
+        while pending:
+            name = pending.pop()
+            stores.add(name)
+            pending.extend(aliases.pop(name, ()))
+        # Comprehension variables are local to the comprehension
+        for node in ast.walk(tree):
+            if isinstance(node, ast.comprehension):
+                targets = {n.id for n in ast.walk(node.target) if isinstance(n, ast.Name)}
+                loads -= targets
+                stores -= targets
+        # Every metric gets its own result slot
+        loads.discard('result')
+        stores.discard('result')
+        return loads, stores
+
+    @staticmethod
+    def _base_name(node: ast.AST) -> Optional[str]:
+        """Name an attribute or subscript chain starts from, e.g. df for df.loc[0]"""
+        while isinstance(node, (ast.Subscript, ast.Attribute)):
+            node = node.value
+        return node.id if isinstance(node, ast.Name) else None
+
     @classmethod
     def _find_unsafe_operations(cls, tree: ast.AST) -> Set[str]:
         """Find any unsafe operations in the AST"""
@@ -113,7 +199,249 @@ class CodeValidator:
         
         return unsafe_ops
 
+class SummaryAccumulator:
+    """Builds the analyze_data summary incrementally from Arrow record batches"""
+
+    # The only columns the summary reads; uploads can skip parsing the rest
+    COLUMNS = ('week', 'views', 'clicks', 'attributed_revenue',
+               'widget_name', 'layout', 'customer_id')
+
+    # Every column is read as text: the streaming reader fixes types from the
+    # first block, so a "1,200" or the first value of a column empty until
+    # then would fail to convert later on. _column_total parses the numbers,
+    # and weeks are compared as numbers when all of them are (as pandas
+    # would infer them), otherwise as text, which keeps ISO dates verbatim.
+    COLUMN_TYPES = {
+        'week': pa.string(),
+        'views': pa.string(),
+        'clicks': pa.string(),
+        'attributed_revenue': pa.string(),
+        'customer_id': pa.string(),
+        'widget_name': pa.string(),
+        'layout': pa.string()
+    }
+
+    def __init__(self):
+        self.columns = []
+        self.total_records = 0
+        self.week_range = None
+        self.numeric_week_range = None
+        self.numeric_weeks = True
+        self.totals = {}
+        self.distributions = {}
+        self.customers = None
+
+    def partial_update(self, batch: pa.RecordBatch):
+        """Fold one record batch into the running summary"""
+        self.columns = batch.schema.names
+        self.total_records += batch.num_rows
+        columns = set(self.columns)
+
+        # Time range using week
+        if 'week' in columns:
+            week = batch.column('week')
+            self.week_range = self._merge_range(self.week_range, week)
+            if self.numeric_weeks:
+                numeric = self._as_number(week)
+                if numeric is None:
+                    self.numeric_weeks = False
+                else:
+                    self.numeric_week_range = self._merge_range(self.numeric_week_range, numeric)
+
+        # Usage metrics
+        for column, metric in [('views', 'total_views'),
+                               ('clicks', 'total_clicks'),
+                               ('attributed_revenue', 'total_revenue')]:
+            if column in columns:
+                self.totals[metric] = self.totals.get(metric, 0.0) + self._column_total(batch.column(column))
+
+        # Content metrics
+        for column, metric in [('widget_name', 'widget_distribution'),
+                               ('layout', 'layout_distribution')]:
+            if column in columns:
+                counts = self.distributions.setdefault(metric, Counter())
+                value_counts = pc.value_counts(pc.drop_null(batch.column(column)))
+                counts.update(dict(zip(value_counts.field('values').to_pylist(),
+                                       value_counts.field('counts').to_pylist())))
+
+        if 'customer_id' in columns:
+            if self.customers is None:
+                self.customers = set()
+            self.customers.update(pc.unique(pc.drop_null(batch.column('customer_id'))).to_pylist())
+
+    def finalize(self) -> Dict:
+        """Return the summary in the same shape as AnalyticsEngine._prepare_data_summary"""
+        summary = {
+            "total_records": self.total_records,
+            "metrics": dict(self.totals)
+        }
+
+        week_range = self.numeric_week_range if self.numeric_weeks else self.week_range
+        if week_range is not None:
+            summary["date_range"] = {
+                "start": week_range[0],
+                "end": week_range[1]
+            }
+
+        for metric, counts in self.distributions.items():
+            summary["metrics"][metric] = dict(counts.most_common())
+
+        if self.customers is not None:
+            summary["metrics"]["unique_customers"] = len(self.customers)
+
+        return summary
+
+    @staticmethod
+    def _merge_range(current: Optional[Tuple], column: pa.Array) -> Optional[Tuple]:
+        """Widen a (min, max) range with the values of a column"""
+        column_range = pc.min_max(column)
+        start, end = column_range['min'].as_py(), column_range['max'].as_py()
+        if start is None:
+            return current
+        if current is None:
+            return (start, end)
+        return (min(current[0], start), max(current[1], end))
+
+    @staticmethod
+    def _as_number(column: pa.Array) -> Optional[pa.Array]:
+        """Parse a text column as integers, else floats; None if some value is neither"""
+        for target in (pa.int64(), pa.float64()):
+            try:
+                return pc.cast(column, target)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                continue
+        return None
+
+    @staticmethod
+    def _column_total(column: pa.Array) -> float:
+        """Sum a column, converting numbers formatted with thousands separators"""
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            column = pc.cast(pc.replace_substring(column, ',', ''), pa.float64())
+        return float(pc.sum(column).as_py() or 0)
+
+class MetricOps:
+    """Named pandas operations that plan metrics can use instead of generated code"""
+
+    # Arguments naming columns; they are upper-cased like the plan's DataFrame
+    COLUMN_ARGS = {'column', 'other', 'by', 'numerator', 'denominator'}
+
+    OPS = {
+        'sum': lambda df, column: df[column].sum(),
+        'mean': lambda df, column: df[column].mean(),
+        'median': lambda df, column: df[column].median(),
+        'min': lambda df, column: df[column].min(),
+        'max': lambda df, column: df[column].max(),
+        'count': lambda df, column: df[column].count(),
+        'nunique': lambda df, column: df[column].nunique(),
+        'quantile': lambda df, column, q=0.5: df[column].quantile(q),
+        'corr': lambda df, column, other: df[column].corr(df[other]),
+        'value_counts': lambda df, column, normalize=False: df[column].value_counts(normalize=normalize),
+        'ratio': lambda df, numerator, denominator: MetricOps._ratio(df[numerator].sum(), df[denominator].sum()),
+        'groupby_sum': lambda df, by, column: df.groupby(by)[column].sum(),
+        'groupby_mean': lambda df, by, column: df.groupby(by)[column].mean(),
+        'groupby_count': lambda df, by: df.groupby(by).size(),
+        'groupby_ratio': lambda df, by, numerator, denominator: MetricOps._group_ratio(
+            df.groupby(by)[[numerator, denominator]].sum(), numerator, denominator
+        ),
+    }
+
+    @classmethod
+    def build(cls, op: str, args: Dict) -> Tuple[str, Any, FrozenSet[str], FrozenSet[str]]:
+        """Resolve an op into the same shape as AnalyticsEngine._compile_metric returns"""
+        if op not in cls.OPS:
+            raise ValueError(f"Unknown metric op: {op}")
+        args = {name: cls._column_name(value) if name in cls.COLUMN_ARGS else value
+                for name, value in (args or {}).items()}
+        runner = functools.partial(cls.OPS[op], **args)
+        return f"{op}({args})", runner, frozenset({'df'}), frozenset()
+
+    @classmethod
+    def _column_name(cls, value):
+        if isinstance(value, list):
+            return [cls._column_name(v) for v in value]
+        return str(value).upper()
+
+    @staticmethod
+    def _ratio(numerator, denominator):
+        return numerator / denominator if denominator else 0
+
+    @staticmethod
+    def _group_ratio(sums: pd.DataFrame, numerator: str, denominator: str) -> pd.Series:
+        return (sums[numerator] / sums[denominator].replace(0, np.nan)).fillna(0)
+
+# Helper functions for the metric execution environment
+
+def safe_divide(a, b):
+    """Safe division handling zeros and NaN"""
+    try:
+        if np.isscalar(a) and np.isscalar(b):
+            # Aggregates divide plain scalars; skip the ufunc and its output array
+            if b == 0:
+                return 0
+            result = a / b
+            return 0 if (np.isnan(result) or np.isinf(result)) else float(result)
+        result = np.divide(a, b, out=np.zeros_like(a, dtype=float), where=b!=0)
+        if isinstance(result, np.ndarray):
+            result[np.isnan(result)] = 0
+            result[np.isinf(result)] = 0
+        elif np.isnan(result) or np.isinf(result):
+            result = 0
+        return result
+    except Exception:
+        return 0
+
+def safe_contains(series, pattern):
+    """Safe string contains operation handling NaN"""
+    try:
+        return series.fillna('').astype(str).str.contains(pattern, case=False, na=False)
+    except Exception:
+        return pd.Series([False] * len(series))
+
+def clean_result(result):
+    """Clean result by replacing NaN/inf with 0"""
+    if isinstance(result, (float, np.float64)):
+        return 0 if (np.isnan(result) or np.isinf(result)) else result
+    elif isinstance(result, np.integer):
+        return int(result)
+    elif isinstance(result, dict):
+        return {k: clean_result(v) for k, v in result.items()}
+    elif isinstance(result, list):
+        return [clean_result(v) for v in result]
+    elif isinstance(result, pd.Series):
+        if result.dtype.kind == 'f':
+            # Float results are cleaned in one NumPy pass
+            return dict(zip(result.index.tolist(), _finite_values(result).tolist()))
+        result = result.replace([np.inf, -np.inf], np.nan).fillna(0)
+        return result.to_dict()
+    elif isinstance(result, pd.DataFrame):
+        if len(result.columns) and all(dtype.kind == 'f' for dtype in result.dtypes):
+            columns = result.columns.tolist()
+            return [dict(zip(columns, row)) for row in _finite_values(result).tolist()]
+        result = result.replace([np.inf, -np.inf], np.nan).fillna(0)
+        return result.to_dict('records')
+    return result
+
+# Types AnalyticsEngine._make_json_serializable returns unchanged, and the
+# exact-type conversions it applies
+_JSON_PRIMITIVES = frozenset({int, float, str, bool, type(None)})
+_JSON_CONVERSIONS = {
+    np.int64: int,
+    np.int32: int,
+    np.float64: float,
+    np.float32: float,
+    np.bool_: bool,
+    np.ndarray: np.ndarray.tolist
+}
+
+def _finite_values(data) -> np.ndarray:
+    """Float values of a Series or DataFrame with NaN and inf replaced by 0"""
+    return np.nan_to_num(data.to_numpy(dtype=float, na_value=np.nan), nan=0.0, posinf=0.0, neginf=0.0)
+
 class AnalyticsEngine:
+    # Columns described for each percentile range (in order of importance)
+    RANGE_CATEGORICAL_COLUMNS = ['ACCOUNT_PLAN', 'WIDGET_PUBLISHMETHOD', 'WIDGET_MEDIA_TYPES']
+    RANGE_NUMERIC_COLUMNS = ['WIDGET_NUMBER_OF_VIDEOS', 'WIDGET_CLICKS', 'WIDGET_VIEWS']
+
     def __init__(self):
         api_key = os.getenv("OPENAI_API_KEY")
         self.client = OpenAI(api_key=api_key)
@@ -125,83 +453,112 @@ class AnalyticsEngine:
         print(f"DONE DEBUGGING OPENAI API KEY IN ANALYZER")
         # END DEBUG CODE
 
+        # Local work that can overlap with a pending OpenAI request
+        self.background = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="analyzer")
+
     def analyze_data(self, 
                     df: pd.DataFrame,
                     business_model: str,
                     value_proposition: str,
-                    target_metrics: List[str],
-                    revenue_drivers: List[str]) -> Dict:
+                    target_metrics: Sequence[str],
+                    revenue_drivers: Sequence[str]) -> Dict:
         """Main analysis pipeline"""
         try:
             # 1. Prepare data summary
             data_summary = self._prepare_data_summary(df)
-            
-            # 2. Force reload prompts
-            with open('config/prompts.yaml', 'r') as file:
-                prompts = yaml.safe_load(file)
-                #print("\nLoaded prompts from YAML:")
-                #print(json.dumps(prompts, indent=2))
-                #print("\n")
-        
-            # 3. Generate insights using GPT-4
-            prompt = prompts['analysis']['user_template'].format(
-                business_model=business_model,
-                value_proposition=value_proposition,
-                target_metrics=', '.join(target_metrics),
-                revenue_drivers=', '.join(revenue_drivers),
-                data_summary=data_summary
-            )
 
-            # Log the complete request we're sending to OpenAI
-            request_payload = {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {"role": "system", "content": prompts['analysis']['system_role']},
-                    {"role": "user", "content": prompt}
-                ],
-                "response_format": { "type": "json_object" },
-                "temperature": 0.3
-            }
-            print("Sending prompt to OpenAI...")
-            print(json.dumps(request_payload, indent=2))
+            return self._recommend(data_summary, business_model, value_proposition,
+                                   target_metrics, revenue_drivers)
 
-            # Make the API call
-            response = self.client.chat.completions.create(
-                **request_payload
-            )
-            
-            # Parse the JSON response
-            raw_response = response.choices[0].message.content
-            print("Raw OpenAI response:", raw_response)
-            
-            insights = json.loads(raw_response)
-            
-            # Ensure we have recommendations
-            if not insights.get('recommendations'):
-                print("No recommendations found in response, using fallback")
-                recommendations = [{
-                    "recommendation": "Error: No recommendations generated. Please try again.",
-                    "revenue_impact": "Unknown",
-                    "confidence": 0.0
-                }]
-            else:
-                recommendations = insights['recommendations']
-            
+        except Exception as e:
+            logger.error("Error in analyze_data: %s", e)
             return {
-                "success": True,
-                "data": {
-                    "recommendations": recommendations,
-                    "metrics": data_summary["metrics"]
-                }
-        }
-            
+                "success": False,
+                "error": str(e)
+            }
+
+    def analyze_summary(self,
+                        summary: 'SummaryAccumulator',
+                        business_model: str,
+                        value_proposition: str,
+                        target_metrics: Sequence[str],
+                        revenue_drivers: Sequence[str]) -> Dict:
+        """Main analysis pipeline for data summarized batch by batch during upload"""
+        try:
+            # 1. Finish the data summary
+            data_summary = summary.finalize()
+
+            return self._recommend(data_summary, business_model, value_proposition,
+                                   target_metrics, revenue_drivers)
+
         except Exception as e:
-            print(f"Error in analyze_data: {e}")
+            logger.error("Error in analyze_summary: %s", e)
             return {
                 "success": False,
                 "error": str(e)
             }
-    
+
+    def _recommend(self,
+                   data_summary: Dict,
+                   business_model: str,
+                   value_proposition: str,
+                   target_metrics: Sequence[str],
+                   revenue_drivers: Sequence[str]) -> Dict:
+        """Generate recommendations from a prepared data summary"""
+        # 2. Load prompts (re-read whenever the file changes)
+        prompts = load_prompts()
+        
+        # 3. Generate insights using GPT-4
+        prompt = prompts['analysis']['user_template'].format(
+            business_model=business_model,
+            value_proposition=value_proposition,
+            target_metrics=', '.join(target_metrics),
+            revenue_drivers=', '.join(revenue_drivers),
+            data_summary=data_summary
+        )
+
+        # Log the complete request we're sending to OpenAI
+        request_payload = {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": prompts['analysis']['system_role']},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": { "type": "json_object" },
+            "temperature": 0.3
+        }
+        self._log_payload("OPENAI REQUEST", request_payload)
+
+        # Make the API call
+        response = self.client.chat.completions.create(
+            **request_payload
+        )
+        
+        # Parse the JSON response
+        raw_response = response.choices[0].message.content
+        logger.debug("Raw OpenAI response: %s", raw_response)
+        
+        insights = json.loads(raw_response)
+        
+        # Ensure we have recommendations
+        if not insights.get('recommendations'):
+            logger.warning("No recommendations found in response, using fallback")
+            recommendations = [{
+                "recommendation": "Error: No recommendations generated. Please try again.",
+                "revenue_impact": "Unknown",
+                "confidence": 0.0
+            }]
+        else:
+            recommendations = insights['recommendations']
+        
+        return {
+            "success": True,
+            "data": {
+                "recommendations": recommendations,
+                "metrics": data_summary["metrics"]
+            }
+        }
+
     def analyze_data_dynamic(
         self, 
         df: pd.DataFrame,
@@ -210,29 +567,31 @@ class AnalyticsEngine:
         business_goal: str = None,  # Optional now
         questions: List[str] = None  # New parameter
     ) -> Dict:
-        print("Starting analyze_dynamic endpoint")
+        logger.debug("Starting analyze_dynamic endpoint")
         try:
-            # 1. First detect patterns in the data
-            print("\n1. First detect patterns in the data")
-            detected_patterns = self._detect_data_patterns(df)
+            df = self._to_pandas_if_needed(df)
+
+            # 1. Detect patterns in the data. They're only needed once the
+            # analysis plan is back, so this runs alongside the plan request
+            logger.debug("1. First detect patterns in the data")
+            patterns_future = self.background.submit(self._detect_data_patterns, df)
 
             # 2. Load prompts
-            print("\n2. Load prompts")            
-            current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            config_path = os.path.join(current_dir, 'config', 'prompts.yaml')
-            
-            with open(config_path, 'r') as file:
-                prompts = yaml.safe_load(file)
+            logger.debug("2. Load prompts")
+            prompts = load_prompts()
 
             # 3. Create enhanced context for analysis plan GPT call
-            print("\n3. Create enhanced context for analysis plan GPT call")            
+            logger.debug("3. Create enhanced context for analysis plan GPT call")
 
+            # Sample records are built from per-column lists of Python scalars
+            head = df.head()
+            columns = head.columns.tolist()
             data_context = {
                 "columns": list(df.columns),
-                "sample_data": df.head().to_dict(orient='records'),
+                "sample_data": [dict(zip(columns, row))
+                                for row in zip(*(head[col].tolist() for col in columns))],
                 "total_rows": len(df),
-                "data_types": df.dtypes.astype(str).to_dict(),
-                "data_patterns": detected_patterns
+                "data_types": {col: str(dtype) for col, dtype in df.dtypes.items()}
             }
             
             # 4. Get analysis strategy with enhanced context
@@ -249,7 +608,7 @@ class AnalyticsEngine:
                 business_goal_section = f"- Business Goal: {business_goal}"
                 questions_section = ""
 
-            print("\n4. Get analysis strategy with enhanced context")            
+            logger.debug("4. Get analysis strategy with enhanced context")
             prompt = prompts['dynamic_analysis']['schema_understanding']['user_template'].format(
             business_model=business_model,
             value_proposition=value_proposition,
@@ -260,7 +619,6 @@ class AnalyticsEngine:
             **data_context
             )
 
-            print("\n=== ANALYSIS PLAN REQUEST ===")
             analysis_request = {
                 "model": "gpt-4o",
                 "messages": [
@@ -276,28 +634,27 @@ class AnalyticsEngine:
                 "response_format": {"type": "json_object"},
                 "temperature": 0.5
             }
-            print(json.dumps(analysis_request, indent=2))
-            print("=== END ANALYSIS PLAN REQUEST ===\n")
+            self._log_payload("ANALYSIS PLAN REQUEST", analysis_request)
 
             response = self.client.chat.completions.create(**analysis_request)
             analysis_plan = json.loads(response.choices[0].message.content)
 
-            print("\n=== ANALYSIS PLAN RESPONSE ===")
-            print(json.dumps(analysis_plan, indent=2))
-            print("\n=== END ANALYSIS PLAN RESPONSE ===")
+            self._log_payload("ANALYSIS PLAN RESPONSE", analysis_plan)
             
             # 5. Execute the analysis plan
-            print("\n5. Execute the analysis plan")            
+            logger.debug("5. Execute the analysis plan")
             analysis_results = self._execute_analysis_plan(df, analysis_plan)
+            detected_patterns = patterns_future.result()
             
             # 6. Get recommendations or answers with enhanced context
-            print("\n6. Get recommendations or answers with enhanced context")       
+            logger.debug("6. Get recommendations or answers with enhanced context")
 
-            if questions:
-                print("\nExecuting question answering path")
+            # Metric results can still hold NumPy arrays and scalars
+            serializable_analysis = self._make_json_serializable(analysis_results)
+            serializable_patterns = self._make_json_serializable(detected_patterns)
 
-                serializable_analysis = self._make_json_serializable(analysis_results)
-                serializable_patterns = self._make_json_serializable(detected_patterns)
+            if questions:
+                logger.debug("Executing question answering path")
 
                 answers_prompt = prompts['dynamic_analysis']['question_answering']['user_template'].format(
                     business_model=business_model,
@@ -308,9 +665,6 @@ class AnalyticsEngine:
                     questions=json.dumps(questions, indent=2)
                 )
 
-                print(f"\nANSWERS PROMPT:{answers_prompt}\n")     
-                print("=== ANSWERS REQUEST ===\n")     
-
                 answers_request = {
                     "model": "gpt-4o",
                     "messages": [
@@ -321,48 +675,44 @@ class AnalyticsEngine:
                     "temperature": 0.3
                 }
 
-                print(json.dumps(answers_request, indent=2))
-                print("=== END ANSWERS REQUEST ===\n")
+                self._log_payload("ANSWERS REQUEST", answers_request)
                 
                 answers_response = self.client.chat.completions.create(**answers_request)
                 answers = json.loads(answers_response.choices[0].message.content)
                 
-                print("=== OPENAI ANSWERS RESPONSE ===\n")
-                print(json.dumps(answers, indent= 2))
-                print("=== END OPENAI ANSWERS RESPONSE ===\n")
+                self._log_payload("OPENAI ANSWERS RESPONSE", answers)
 
+                # The analysis and patterns were made serializable for the prompt
+                # above, and the answers come straight from json.loads
                 final_response = {
                     "success": True,
-                    "data": self._make_json_serializable({
-                        "analysis": analysis_results,
-                        "patterns": detected_patterns,
+                    "data": {
+                        "analysis": serializable_analysis,
+                        "patterns": serializable_patterns,
                         "answers": answers.get('answers', [])
-                    })
+                    }
                 }
-                print("Final response structure:", final_response)
-                try:
-                    # Test JSON serialization
-                    json_str = json.dumps(final_response)
-                    print("JSON serialization successful")
-                except TypeError as e:
-                    print("JSON serialization failed:", str(e))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Final response structure: %s", final_response)
+                    try:
+                        # Test JSON serialization
+                        json.dumps(final_response)
+                        logger.debug("JSON serialization successful")
+                    except TypeError as e:
+                        logger.debug("JSON serialization failed: %s", e)
 
                 return final_response
             else:
-                print("\nExecuting recommendations path")
+                logger.debug("Executing recommendations path")
 
-
-                print("=== RECOMMENDATION REQUEST ===\n")     
                 recommendations_prompt = prompts['dynamic_analysis']['recommendations']['user_template'].format(
                     business_model=business_model,
                     value_proposition=value_proposition,
                     business_goal=business_goal,
-                    analysis_results=json.dumps(analysis_results, indent=2),
-                    data_patterns=detected_patterns
+                    analysis_results=json.dumps(serializable_analysis, indent=2),
+                    data_patterns=serializable_patterns
                 )
 
-                print(f"\nRECOMMENDATION PROMPT:{recommendations_prompt}\n")     
-
                 recommendations_request = {
                     "model": "gpt-4o",
                     "messages": [
@@ -379,31 +729,33 @@ class AnalyticsEngine:
                     "temperature": 0.3
                 }
 
-                print(json.dumps(recommendations_request, indent=2))
-                print("=== END RECOMMENDATION REQUEST ===\n")
+                self._log_payload("RECOMMENDATION REQUEST", recommendations_request)
 
                 recommendations_response = self.client.chat.completions.create(**recommendations_request)
                 recommendations = json.loads(recommendations_response.choices[0].message.content)
-                print("=== OPENAI RECOMMENDATION RESPONSE ===\n")
-                print(json.dumps(recommendations, indent=2))
-                print("=== END OPENAI RECOMMENDATION RESPONSE ===\n")
+                self._log_payload("OPENAI RECOMMENDATION RESPONSE", recommendations)
 
                 return {
                     "success": True,
                     "data": {
-                        "analysis": analysis_results,
-                        "patterns": detected_patterns,  # Include patterns in response
+                        "analysis": serializable_analysis,
+                        "patterns": serializable_patterns,  # Include patterns in response
                         "recommendations": recommendations.get('recommendations', [])
                     }
                 }
                 
         except Exception as e:
-            print(f"Error in dynamic analysis: {e}")
+            logger.error("Error in dynamic analysis: %s", e)
             return {
                 "success": False,
                 "error": str(e)
             }
         
+    def _log_payload(self, title: str, payload: Any):
+        """Log a request or response payload, encoding it only when debug logging is on"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("=== %s ===\n%s", title, json.dumps(payload, indent=2, default=str))
+
     def _detect_data_patterns(self, df: pd.DataFrame) -> Dict:
         """Detect patterns in the data to provide better context"""
         patterns = {
@@ -415,60 +767,63 @@ class AnalyticsEngine:
         }
         
         try:
+            column_kinds = self._classify_columns(df)
+            numeric_cols = column_kinds['numeric']
+            row_count = len(df)
+
             # 1. Temporal Patterns (keeping existing logic)
-            date_cols = df.select_dtypes(include=['datetime64']).columns
-            for col in date_cols:
+            for col in column_kinds['date']:
+                start, end = df[col].min(), df[col].max()
                 patterns['temporal_patterns'][col] = {
                     "frequency": pd.infer_freq(df[col]),
                     "range": {
-                        "start": df[col].min().isoformat(),
-                        "end": df[col].max().isoformat(),
-                        "span_days": (df[col].max() - df[col].min()).days
+                        "start": start.isoformat(),
+                        "end": end.isoformat(),
+                        "span_days": (end - start).days
                     }
                 }
 
             # 2. Numeric Patterns and Correlations
-            numeric_cols = df.select_dtypes(include=['int64', 'float64']).columns
+            links = {'counts': Counter(), 'related': {}}
             if len(numeric_cols) >= 2:
                 # Calculate correlations (keeping existing logic)
-                corr_matrix = df[numeric_cols].corr()
-                for i in range(len(numeric_cols)):
-                    for j in range(i + 1, len(numeric_cols)):
-                        corr = corr_matrix.iloc[i, j]
-                        if abs(corr) > 0.7:  # Strong correlation threshold
-                            patterns['correlations'].append({
-                                "columns": [numeric_cols[i], numeric_cols[j]],
-                                "correlation": corr
-                            })
+                corr_matrix = self._fast_corr(df, numeric_cols)
+                patterns['correlations'] = [
+                    {"columns": [col_a, col_b], "correlation": corr}
+                    for col_a, col_b, corr in self._correlated_pairs(corr_matrix, 0.7)  # Strong correlation threshold
+                ]
                 
                 # Add relationship analysis
-                patterns['relationships'] = self._analyze_relationships(df)
+                patterns['relationships'] = self._analyze_relationships(
+                    df, numeric_cols, column_kinds['non_numeric'], corr_matrix, links
+                )
 
             # 3. Categorical Patterns (enhanced from existing)
-            for col in df.select_dtypes(include=['object']).columns:
-                unique_ratio = df[col].nunique() / len(df)
+            text_cols = column_kinds['text']
+            # Count distinct values for all text columns in one call
+            unique_counts = df[text_cols].nunique() if len(text_cols) else pd.Series(dtype='int64')
+            for col in text_cols:
+                unique_values = int(unique_counts[col])
+                unique_ratio = unique_values / row_count
                 if unique_ratio < 0.1:  # Likely a category
                     cat_pattern = {
-                        "unique_values": df[col].nunique(),
+                        "unique_values": unique_values,
                         "distribution": df[col].value_counts(normalize=True).to_dict()
                     }
                     
                     # Add impact analysis on numeric columns
                     if len(numeric_cols) > 0:
-                        cat_pattern['numeric_impacts'] = {
-                            num_col: self._analyze_categorical_impact(df, col, num_col)
-                            for num_col in numeric_cols
-                        }
+                        cat_pattern['numeric_impacts'] = self._analyze_categorical_impact(df, col, numeric_cols)
                     
                     patterns['categorical_patterns'][col] = cat_pattern
 
             # 4. Identify Key Metrics
-            patterns['key_metrics'] = self._identify_key_metrics(df, patterns['relationships'])
+            patterns['key_metrics'] = self._identify_key_metrics(df, links)
 
             return patterns
             
         except Exception as e:
-            print(f"Error in pattern detection: {e}")
+            logger.error("Error in pattern detection: %s", e)
             return {
                 'temporal_patterns': {},
                 'correlations': [],
@@ -482,22 +837,25 @@ class AnalyticsEngine:
         enriched = base_results.copy()
         
         # Add trend analysis for time series data
-        date_cols = df.select_dtypes(include=['datetime64']).columns
+        column_kinds = self._classify_columns(df)
+        date_cols = column_kinds['date']
         if len(date_cols) > 0:
             primary_date_col = date_cols[0]
-            numeric_cols = df.select_dtypes(include=['int64', 'float64']).columns
+            numeric_cols = column_kinds['numeric']
             
             trends = {}
-            for col in numeric_cols:
-                if col in base_results:  # Only analyze metrics we've calculated
-                    # Calculate growth rates
-                    series = df.set_index(primary_date_col)[col]
-                    if len(series) > 1:
-                        growth_rate = ((series.iloc[-1] / series.iloc[0]) - 1) * 100
-                        trends[f"{col}_growth"] = {
-                            "total_growth_percent": growth_rate,
-                            "volatility": series.pct_change().std() * 100
-                        }
+            # Only analyze metrics we've calculated
+            tracked_cols = [col for col in numeric_cols if col in base_results]
+            if tracked_cols and len(df) > 1:
+                # Calculate growth rates for all tracked columns at once
+                series = df.set_index(primary_date_col)[tracked_cols]
+                growth_rates = ((series.iloc[-1] / series.iloc[0]) - 1) * 100
+                volatility = series.pct_change().std() * 100
+                for col in tracked_cols:
+                    trends[f"{col}_growth"] = {
+                        "total_growth_percent": growth_rates[col],
+                        "volatility": volatility[col]
+                    }
             
             enriched["trends"] = trends
         
@@ -520,73 +878,45 @@ class AnalyticsEngine:
         try:
             results = {}
             
-            # Preprocess the dataframe
-            df = df.copy()
+            # Preprocess the dataframe. A shallow copy is enough to rename the
+            # columns; filtering the rows below builds new column arrays
+            df = df.copy(deep=False)
             df.columns = df.columns.str.upper()
             
             # Remove header rows (rows where columns contain their descriptions)
+            # and description rows in the string columns, collecting one mask so
+            # the frame is filtered once instead of once per column
+            keep = np.ones(len(df), dtype=bool)
             for col in df.columns:
-                # Check if any values in the column match the column name description
-                mask = ~df[col].astype(str).str.contains(col, case=False, na=False)
-                df = df[mask]
-            
-            # Convert numeric columns and handle NaN values
-            for col in df.columns:
-                try:
-                    if 'VIEWS' in col.upper() or 'CLICKS' in col.upper():
-                        df[col] = pd.to_numeric(df[col].str.replace(',', ''), errors='coerce').fillna(0)
-                    elif 'NUMBER_OF' in col.upper():
-                        df[col] = pd.to_numeric(df[col].str.replace(',', ''), errors='coerce').fillna(0)
-                except (ValueError, AttributeError):
-                    continue
+                # Check if any values in the column match the column name description.
+                # The name is matched literally, it is not a pattern
+                keep &= ~df[col].astype(str).str.contains(col, case=False, na=False, regex=False).to_numpy()
             
-            # Clean string columns
             string_columns = ['WIDGET_MEDIA_TYPES', 'WIDGET_PUBLISHMETHOD', 'WIDGET_PAGE_TYPES', 'ACCOUNT_PLAN']
             for col in string_columns:
                 if col in df.columns:
                     # Remove rows where the column contains its own description
-                    df = df[~df[col].astype(str).str.contains('widget|account|placement', case=False, na=False)]
+                    keep &= ~df[col].astype(str).str.contains('widget|account|placement', case=False, na=False).to_numpy()
+            df = df[keep]
             
-            print("\nAvailable columns:", df.columns.tolist())
-            print("\nColumn dtypes after preprocessing:", df.dtypes)
-            
-            # Helper functions for the execution environment
-            def safe_divide(a, b):
-                """Safe division handling zeros and NaN"""
-                try:
-                    result = np.divide(a, b, out=np.zeros_like(a, dtype=float), where=b!=0)
-                    if isinstance(result, np.ndarray):
-                        result[np.isnan(result)] = 0
-                        result[np.isinf(result)] = 0
-                    elif np.isnan(result) or np.isinf(result):
-                        result = 0
-                    return result
-                except Exception:
-                    return 0
-
-            def safe_contains(series, pattern):
-                """Safe string contains operation handling NaN"""
+            # Convert numeric columns and handle NaN values. Only text columns
+            # need parsing, and the converted columns are put back in one step
+            converted = {}
+            for col in df.columns:
+                if not any(key in col for key in ('VIEWS', 'CLICKS', 'NUMBER_OF')):
+                    continue
+                if not (pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col])):
+                    continue
                 try:
-                    return series.fillna('').astype(str).str.contains(pattern, case=False, na=False)
-                except Exception:
-                    return pd.Series([False] * len(series))
-
-            def clean_result(result):
-                """Clean result by replacing NaN/inf with 0"""
-                if isinstance(result, (float, np.float64)):
-                    return 0 if (np.isnan(result) or np.isinf(result)) else result
-                elif isinstance(result, dict):
-                    return {k: clean_result(v) for k, v in result.items()}
-                elif isinstance(result, list):
-                    return [clean_result(v) for v in result]
-                elif isinstance(result, pd.Series):
-                    result = result.replace([np.inf, -np.inf], np.nan).fillna(0)
-                    return result.to_dict()
-                elif isinstance(result, pd.DataFrame):
-                    result = result.replace([np.inf, -np.inf], np.nan).fillna(0)
-                    return result.to_dict('records')
-                return result
-
+                    converted[col] = pd.to_numeric(df[col].str.replace(',', '', regex=False), errors='coerce').fillna(0)
+                except (ValueError, AttributeError):
+                    continue
+            if converted:
+                df = df.assign(**converted)
+            
+            logger.debug("Available columns: %s", df.columns.tolist())
+            logger.debug("Column dtypes after preprocessing:\n%s", df.dtypes)
+            
             # Persistent execution environment
             execution_namespace = {
                 'pd': pd,
@@ -603,73 +933,146 @@ class AnalyticsEngine:
                 'clean_result': clean_result
             }
             
-            for metric in analysis_plan.get('metrics', []):
-                try:
-                    print(f"\nAttempting to calculate metric: {metric['name']}")
-                    
-                    code = metric['code'].replace('data[', 'df[')                    
+            # Metrics run concurrently unless one reads or overwrites a variable
+            # (including df) that another in the same batch writes. The batch
+            # shares df itself; pandas 3's copy-on-write (see requirements.txt)
+            # keeps frames derived from it from writing back into it
+            for batch in self._plan_batches(analysis_plan.get('metrics', [])):
+                if len(batch) == 1:
+                    # Nothing runs alongside it, so it can use the shared namespace
+                    outcomes = [self._run_metric(*batch[0], execution_namespace, df)]
+                else:
+                    futures = [
+                        self.background.submit(self._run_metric, metric, code,
+                                               dict(execution_namespace), df)
+                        for metric, code in batch
+                    ]
+                    outcomes = [future.result() for future in futures]
 
-                    # Replace unsafe operations with safe versions
-                    if 'str.contains' in code:
-                        code = code.replace('.str.contains', '.pipe(safe_contains')
-                        code = code.replace(')', ')')
-                    
-                    if '/' in code and ('sum()' in code or 'mean()' in code):
-                        # Replace division with safe_divide for aggregations
-                        code = code.replace('x[', 'safe_divide(x[')
-                        code = code.replace('] /', '].sum(), x[')
-                        code = code.replace('sum()', 'sum())')
-                    
-                    # Add existing results to the namespace
-                    for var_name, value in results.items():
-                        clean_name = var_name.lower().replace(' ', '_')
-                        execution_namespace[clean_name] = value
-                    
-                    # Validate and sanitize the code
-                    is_valid, sanitized_code, error_msg = CodeValidator.validate_code(code)
-                    
-                    if not is_valid:
-                        raise ValueError(f"Invalid code: {error_msg}")
-                    
-                    print(f"Sanitized code:\n{sanitized_code}")
-                    
-                    # Execute the validated code
-                    exec(sanitized_code, execution_namespace, execution_namespace)
-                    
-                    result = execution_namespace.get('result')
-                    if result is not None:
-                        # Check if result is too large and needs percentile analysis
-                        needs_percentiles, processed_result = self._check_and_convert_large_result(result, df)
-                        if needs_percentiles:
-                            result = processed_result
-                        else:
-                        # Clean the result (replace NaN/inf with 0)
-                            result = clean_result(result)
-                            
-                        # Round floats
-                        if isinstance(result, float):
-                            result = round(result, 2)
-                        elif isinstance(result, dict):
-                            result = {k: round(v, 2) if isinstance(v, float) else v 
-                                    for k, v in result.items()}
-                        
+                # Apply the batch in plan order, as if the metrics ran one after another
+                for (metric, _), (namespace, result, error) in zip(batch, outcomes):
+                    if namespace is not execution_namespace:
+                        execution_namespace.update(namespace)
+                    if error is not None:
+                        logger.error("Error calculating metric %s: %s", metric['name'], error)
+                        results[metric['name']] = f"Error: {str(error)}"
+                    elif result is not None:
                         # Store result
                         results[metric['name']] = result
                         clean_name = metric['name'].lower().replace(' ', '_')
                         execution_namespace[clean_name] = result
                         
-                        print(f"Successfully calculated {metric['name']}: {result}")
-
-                except Exception as e:
-                    print(f"Error calculating metric {metric['name']}: {str(e)}")
-                    results[metric['name']] = f"Error: {str(e)}"
+                        logger.debug("Successfully calculated %s: %s", metric['name'], result)
             
             return results
             
         except Exception as e:
-            print(f"Error executing analysis plan: {e}")
+            logger.error("Error executing analysis plan: %s", e)
             return {}
 
+    def _plan_batches(self, metrics: List[Dict]) -> List[List[Tuple[Dict, Any]]]:
+        """Split plan metrics into consecutive batches that can run concurrently
+
+        Each metric is paired with its compiled code (see _compile_metric) or
+        resolved op (see MetricOps), or the exception that rejected it. A
+        metric starts a new batch when it reads a name written earlier in the
+        current batch, or writes a name the batch already uses.
+        """
+        batches, batch = [], []
+        batch_loads, batch_stores = set(), set()
+        for metric in metrics:
+            try:
+                if metric.get('op'):
+                    code = MetricOps.build(metric['op'], metric.get('args'))
+                else:
+                    code = self._compile_metric(metric['code'])
+                loads, stores = code[2], code[3] | {metric['name'].lower().replace(' ', '_')}
+            except Exception as e:
+                code, loads, stores = e, set(), set()
+
+            if batch and (loads & batch_stores or stores & (batch_loads | batch_stores)):
+                batches.append(batch)
+                batch, batch_loads, batch_stores = [], set(), set()
+            batch.append((metric, code))
+            batch_loads |= loads
+            batch_stores |= stores
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _compile_metric(code: str) -> Tuple[str, CodeType, FrozenSet[str], FrozenSet[str]]:
+        """Sanitize and compile metric code, with the names it reads and writes
+
+        Cached on the raw code, since plans for similar data tend to repeat the
+        same snippets; rejected code raises and is not cached.
+        """
+        sanitized_code = AnalyticsEngine._prepare_metric_code(code)
+        loads, stores = CodeValidator.names_used(sanitized_code)
+        return (sanitized_code, compile(sanitized_code, '<metric>', 'exec'),
+                frozenset(loads), frozenset(stores))
+
+    @staticmethod
+    def _prepare_metric_code(code: str) -> str:
+        """Rewrite generated metric code into its safe form and validate it"""
+        code = code.replace('data[', 'df[')                    
+
+        # Replace unsafe operations with safe versions
+        if 'str.contains' in code:
+            code = code.replace('.str.contains', '.pipe(safe_contains')
+            code = code.replace(')', ')')
+        
+        if '/' in code and ('sum()' in code or 'mean()' in code):
+            # Replace division with safe_divide for aggregations
+            code = code.replace('x[', 'safe_divide(x[')
+            code = code.replace('] /', '].sum(), x[')
+            code = code.replace('sum()', 'sum())')
+        
+        # Validate and sanitize the code
+        is_valid, sanitized_code, error_msg = CodeValidator.validate_code(code)
+        
+        if not is_valid:
+            raise ValueError(f"Invalid code: {error_msg}")
+        return sanitized_code
+
+    def _run_metric(self, metric: Dict, code: Any, namespace: Dict,
+                    df: pd.DataFrame) -> Tuple[Dict, Any, Exception]:
+        """Execute one metric in its own namespace; returns (namespace, result, error)"""
+        if isinstance(code, Exception):
+            return namespace, None, code
+        try:
+            logger.debug("Attempting to calculate metric: %s", metric['name'])
+            logger.debug("Sanitized code:\n%s", code[0])
+            
+            # Execute the validated code, or call the op on the current df
+            namespace['result'] = None
+            if isinstance(code[1], CodeType):
+                exec(code[1], namespace)
+            else:
+                namespace['result'] = code[1](namespace['df'])
+            
+            result = namespace.get('result')
+            if result is not None:
+                # Check if result is too large and needs percentile analysis
+                needs_percentiles, processed_result = self._check_and_convert_large_result(result, df)
+                if needs_percentiles:
+                    result = processed_result
+                else:
+                # Clean the result (replace NaN/inf with 0)
+                    result = clean_result(result)
+                    
+                # Round floats
+                if isinstance(result, float):
+                    result = round(result, 2)
+                elif isinstance(result, dict):
+                    result = {k: round(v, 2) if isinstance(v, float) else v 
+                            for k, v in result.items()}
+            return namespace, result, None
+        except Exception as e:
+            return namespace, None, e
+
     def _check_and_convert_large_result(self, result: Any, df: pd.DataFrame) -> Tuple[bool, Any]:
         """Check if result is too large and convert to percentile analysis if needed"""
         TOKEN_LIMIT = 1000  # Approximate threshold for when to switch to percentiles
@@ -690,7 +1093,7 @@ class AnalyticsEngine:
             
             return False, result
         except Exception as e:
-            print(f"Error in size check: {e}")
+            logger.error("Error in size check: %s", e)
             return False, result
 
     def _analyze_series_by_percentiles(self, series: pd.Series, df: pd.DataFrame, 
@@ -698,24 +1101,45 @@ class AnalyticsEngine:
         """Analyze a series using percentile ranges"""
         percentile_ranges = [(0,1), (1,5), (5,10), (10,25), (25,50), (50,100)]
         results = {}
+
+        # All breakpoints from one percentile call instead of two per range
+        values = series.to_numpy()
+        try:
+            breakpoints = np.percentile(values, [0, 1, 5, 10, 25, 50, 100])
+        except Exception as e:
+            logger.error("Error computing percentiles: %s", e)
+            return results
+        
+        # Range k holds the values in (breakpoints[k], breakpoints[k + 1]]
+        bins = np.searchsorted(breakpoints, values, side='left') - 1
+
+        # Only the described columns are needed per range, so filter those
+        # rather than whole rows
+        described = [col for col in self.RANGE_CATEGORICAL_COLUMNS + self.RANGE_NUMERIC_COLUMNS
+                     if col in df.columns]
+        narrow = df[described]
+        keys = df[entity_col] if entity_col in df.columns else df.index
+        if series.index.is_unique:
+            # Range of each row's entity, looked up once for all ranges
+            positions = series.index.get_indexer(keys)
+            row_bins = np.where(positions >= 0, bins[positions], -1)
+        else:
+            row_bins = None
         
-        for start, end in percentile_ranges:
+        for k, (start, end) in enumerate(percentile_ranges):
             try:
                 # Get values in this percentile range
-                lower = np.percentile(series, start)
-                upper = np.percentile(series, end)
-                mask = (series > lower) & (series <= upper)
-                range_data = series[mask]
+                mask = bins == k
+                range_data = values[mask]
                 
                 if len(range_data) == 0:
                     continue
                 
                 # Get entities in this range
-                entities = range_data.index
-                if entity_col in df.columns:
-                    entities_df = df[df[entity_col].isin(entities)]
+                if row_bins is not None:
+                    entities_df = narrow[row_bins == k]
                 else:
-                    entities_df = df.loc[df.index.isin(entities)]
+                    entities_df = narrow[np.asarray(keys.isin(series.index[mask]))]
                 
                 # Calculate range stats
                 range_name = f"top_{end}%" if start == 0 else f"{start}%_to_{end}%"
@@ -724,13 +1148,13 @@ class AnalyticsEngine:
                         "min": float(range_data.min()),
                         "max": float(range_data.max()),
                         "mean": float(range_data.mean()),
-                        "median": float(range_data.median())
+                        "median": float(np.median(range_data))
                     },
                     "sample_size": int(len(range_data)),
                     "characteristics": self._get_range_characteristics(entities_df)
                 }
             except Exception as e:
-                print(f"Error analyzing range {start}-{end}: {e}")
+                logger.error("Error analyzing range %s-%s: %s", start, end, e)
                 continue
         
         return results
@@ -739,22 +1163,14 @@ class AnalyticsEngine:
         """Get key characteristics of entities in a range"""
         chars = {}
         
-        # Define key columns we care about (in order of importance)
-        key_categorical_cols = [
-            'ACCOUNT_PLAN', 
-            'WIDGET_PUBLISHMETHOD',
-            'WIDGET_MEDIA_TYPES'
-        ]
-        
-        key_numeric_cols = [
-            'WIDGET_NUMBER_OF_VIDEOS',
-            'WIDGET_CLICKS',
-            'WIDGET_VIEWS'
-        ]
-        
+        types = pd.api.types
+
         # Process categorical columns
-        for col in key_categorical_cols:
-            if col in df.columns and df[col].dtype in ['object', 'category']:
+        for col in self.RANGE_CATEGORICAL_COLUMNS:
+            if col not in df.columns:
+                continue
+            dtype = df[col].dtype
+            if types.is_object_dtype(dtype) or types.is_string_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
                 value_counts = df[col].value_counts(normalize=True)
                 if not value_counts.empty:
                     # Only take top 2 values and round frequencies
@@ -766,8 +1182,8 @@ class AnalyticsEngine:
                     }
         
         # Process numeric columns
-        for col in key_numeric_cols:
-            if col in df.columns and df[col].dtype in ['int64', 'float64']:
+        for col in self.RANGE_NUMERIC_COLUMNS:
+            if col in df.columns and types.is_numeric_dtype(df[col]) and not types.is_bool_dtype(df[col]):
                 chars[col] = {
                     'avg': round(float(df[col].mean()), 1),
                     'med': round(float(df[col].median()), 1)
@@ -777,19 +1193,29 @@ class AnalyticsEngine:
 
     def _make_json_serializable(self, obj):
         """Convert objects to JSON serializable format"""
-            # Add debugging
-        if isinstance(obj, (np.int64, np.int32, np.integer)):
-            print(f"Converting numpy int type: {type(obj)}")
+        # Plain values are returned as they are, and the common NumPy types
+        # are converted by exact type in one lookup
+        obj_type = type(obj)
+        if obj_type in _JSON_PRIMITIVES:
+            return obj
+        convert = _JSON_CONVERSIONS.get(obj_type)
+        if convert is not None:
+            return convert(obj)
 
         if isinstance(obj, pd.DataFrame):
             # If DataFrame is too large, return summary statistics
             if len(obj) > 100:  # arbitrary threshold
-                print("^^^^INPUT IS TOO LARGE, USING A SAMPLE OF 50 ROWS^^^^")
+                logger.debug("Input is too large, using a sample of 50 rows")
+                numeric_cols = obj.select_dtypes(include=['number']).columns
+                sample = obj.head(50)  # just first 50 rows as sample
+                columns = sample.columns.tolist()
                 return {
                     'summary': {
                         'count': len(obj),
-                        'mean': obj.mean().to_dict() if obj.select_dtypes(include=['number']).columns.any() else None,
-                        'sample': obj.head(50).to_dict(orient='records')  # just first 50 rows as sample
+                        'mean': dict(zip(numeric_cols, obj[numeric_cols].mean().tolist())) if len(numeric_cols) else None,
+                        # Build the records from per-column lists of Python scalars
+                        'sample': [dict(zip(columns, row))
+                                   for row in zip(*(sample[col].tolist() for col in columns))]
                     }
                 }
             return obj.to_dict(orient='records')
@@ -797,19 +1223,16 @@ class AnalyticsEngine:
         if isinstance(obj, pd.Series):
             # If Series is too large, return summary
             if len(obj) > 100:
-                print("^^^^INPUT IS TOO LARGE, USING A SAMPLE OF 50 ROWS^^^^")
+                logger.debug("Input is too large, using a sample of 50 rows")
                 return {
                     'summary': {
                         'count': len(obj),
                         'mean': obj.mean() if pd.api.types.is_numeric_dtype(obj) else None,
-                        'sample': dict(list(obj.items())[:50])  # first 50 items
+                        'sample': obj.head(50).to_dict()  # first 50 items
                     }
                 }
             return obj.to_dict()
 
-        if isinstance(obj, (np.int64, np.int32)):
-            return int(obj)
-        
         if isinstance(obj, np.integer):
             return int(obj)
 
@@ -827,6 +1250,67 @@ class AnalyticsEngine:
 
         return obj
 
+    def warm_up(self, table: pa.Table):
+        """Run the pandas conversion, summary and pattern detection on a small table, without calling OpenAI"""
+        df = self._to_pandas_if_needed(table)
+        self._prepare_data_summary(df)
+        self._detect_data_patterns(df)
+
+    def _to_pandas_if_needed(self, data) -> pd.DataFrame:
+        """Convert Arrow tables for the pandas-based analysis paths
+
+        The table is consumed: each Arrow column is released as soon as it has
+        been converted, so peak memory stays near one copy of the data.
+        """
+        if isinstance(data, pa.Table):
+            return self._match_read_csv(data).to_pandas(split_blocks=True, self_destruct=True)
+        return data
+
+    def _match_read_csv(self, table: pa.Table) -> pa.Table:
+        """Give an Arrow-parsed table the columns pd.read_csv would have produced
+
+        Uploads are read with dates and times as text (see ingest), but a
+        column whose first date only comes after the sampled start of the file
+        is still inferred; dates are cast back exactly, times gain seconds.
+        Arrow also keeps repeated header names, which pandas renames to
+        name.1, name.2...
+        """
+        for i, field in enumerate(table.schema):
+            if pa.types.is_temporal(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+
+        # Same renaming as pandas' C parser, which also avoids names that
+        # appear later in the header
+        header = set(table.column_names)
+        names, counts = [], {}
+        for original in table.column_names:
+            name, count = original, counts.get(original, 0)
+            while count > 0:
+                counts[original] = count + 1
+                name = f"{original}.{count}"
+                count = count + 1 if name in header else counts.get(name, 0)
+            counts[name] = count + 1
+            names.append(name)
+        if names != table.column_names:
+            table = table.rename_columns(names)
+        return table
+
+    def _numeric_values(self, series: pd.Series) -> np.ndarray:
+        """Convert a column of numbers, possibly written with thousands separators, to float64"""
+        if pd.api.types.is_numeric_dtype(series):
+            return series.to_numpy(dtype=np.float64)
+        cleaned = series.astype(str).str.replace(',', '', regex=False)
+        return pd.to_numeric(cleaned).to_numpy(dtype=np.float64)
+
+    def _min_max(self, series: pd.Series) -> Tuple[Any, Any]:
+        """Smallest and largest value, in one Arrow pass for Arrow-backed strings"""
+        dtype = series.dtype
+        if isinstance(dtype, pd.StringDtype) and dtype.storage == 'pyarrow':
+            extremes = pc.min_max(pa.array(series))
+            if extremes['min'].is_valid:
+                return extremes['min'].as_py(), extremes['max'].as_py()
+        return series.min(), series.max()
+
     def _prepare_data_summary(self, df: pd.DataFrame) -> Dict:
         """Create a summary of the data for GPT-4"""
         summary = {
@@ -836,27 +1320,22 @@ class AnalyticsEngine:
         
         # Time range using week
         if 'week' in df.columns:
+            start, end = self._min_max(df['week'])
             summary["date_range"] = {
-                "start": df['week'].min(),
-                "end": df['week'].max()
+                "start": start,
+                "end": end
             }
         
-        # Function to safely convert string numbers with commas to float
-        def safe_numeric_conversion(value):
-            if isinstance(value, str):
-                # Remove commas and convert to float
-                return float(value.replace(',', ''))
-            return float(value)
-        
-        # Usage metrics
+        # Usage metrics: each column is converted to a float64 array once and
+        # reduced in NumPy instead of a per-row Python loop
         if 'views' in df.columns:
-            summary["metrics"]["total_views"] = sum(safe_numeric_conversion(x) for x in df['views'])
+            summary["metrics"]["total_views"] = float(self._numeric_values(df['views']).sum())
         
         if 'clicks' in df.columns:
-            summary["metrics"]["total_clicks"] = sum(safe_numeric_conversion(x) for x in df['clicks'])
+            summary["metrics"]["total_clicks"] = float(self._numeric_values(df['clicks']).sum())
         
         if 'attributed_revenue' in df.columns:
-            summary["metrics"]["total_revenue"] = sum(safe_numeric_conversion(x) for x in df['attributed_revenue'])
+            summary["metrics"]["total_revenue"] = float(self._numeric_values(df['attributed_revenue']).sum())
         
         # Content metrics
         if 'widget_name' in df.columns:
@@ -873,105 +1352,173 @@ class AnalyticsEngine:
     def _analyze_data_structure(self, df: pd.DataFrame) -> Dict:
         """Analyze structure of each column"""
         structure = {}
+        types = pd.api.types
+        numeric, temporal, categorical = [], [], []
+        for col, dtype in df.dtypes.items():
+            if types.is_numeric_dtype(dtype):
+                numeric.append(col)
+            elif types.is_datetime64_dtype(dtype):
+                temporal.append(col)
+            else:
+                categorical.append(col)
+        numeric_set, temporal_set = set(numeric), set(temporal)
+
+        # Reduce each statistic over all columns of a kind at once
+        if numeric:
+            numeric_df = df[numeric]
+            minimums, maximums, means = numeric_df.min(), numeric_df.max(), numeric_df.mean()
+            null_percentages = (numeric_df.isnull().sum() / len(df)) * 100
+        if temporal:
+            starts, ends = df[temporal].min(), df[temporal].max()
+        if categorical:
+            unique_counts = df[categorical].nunique()
         
         for column in df.columns:
-            col_data = df[column]
-            
-            if pd.api.types.is_numeric_dtype(col_data):
+            if column in numeric_set:
                 structure[column] = {
                     'type': 'numeric',
                     'stats': {
-                        'min': float(col_data.min()),
-                        'max': float(col_data.max()),
-                        'mean': float(col_data.mean()),
-                        'null_percentage': (col_data.isnull().sum() / len(col_data)) * 100
+                        'min': float(minimums[column]),
+                        'max': float(maximums[column]),
+                        'mean': float(means[column]),
+                        'null_percentage': null_percentages[column]
                     }
                 }
-            elif pd.api.types.is_datetime64_dtype(col_data):
+            elif column in temporal_set:
                 structure[column] = {
                     'type': 'temporal',
                     'range': {
-                        'start': col_data.min().isoformat(),
-                        'end': col_data.max().isoformat()
+                        'start': starts[column].isoformat(),
+                        'end': ends[column].isoformat()
                     }
                 }
             else:
                 structure[column] = {
                     'type': 'categorical',
-                    'unique_values': col_data.nunique(),
-                    'distribution': col_data.value_counts(normalize=True).head().to_dict()
+                    'unique_values': int(unique_counts[column]),
+                    'distribution': df[column].value_counts(normalize=True).head().to_dict()
                 }
         
         return structure
 
-    def _analyze_relationships(self, df: pd.DataFrame) -> Dict:
-        """Analyze relationships between columns"""
+    def _classify_columns(self, df: pd.DataFrame) -> Dict[str, pd.Index]:
+        """Group columns by dtype in a single pass over the dtypes"""
+        types = pd.api.types
+        kinds = {'date': [], 'numeric': [], 'text': [], 'non_numeric': []}
+        for col, dtype in df.dtypes.items():
+            is_date = types.is_datetime64_any_dtype(dtype)
+            if is_date:
+                kinds['date'].append(col)
+            if types.is_numeric_dtype(dtype) and not types.is_bool_dtype(dtype):
+                kinds['numeric'].append(col)
+                continue
+            if types.is_object_dtype(dtype) or types.is_string_dtype(dtype):
+                kinds['text'].append(col)
+            if not is_date:
+                kinds['non_numeric'].append(col)
+        return {kind: pd.Index(cols, dtype=object) for kind, cols in kinds.items()}
+
+    def _analyze_relationships(self, df: pd.DataFrame, numeric_cols: pd.Index, categorical_cols: pd.Index,
+                               corr_matrix: pd.DataFrame = None, links: Dict = None) -> Dict:
+        """Analyze relationships between columns, reusing corr_matrix when the caller has one
+
+        `links` ({'counts': Counter, 'related': dict}) is filled with how many
+        relationships each column takes part in and its correlated columns.
+        """
+        if links is None:
+            links = {'counts': Counter(), 'related': {}}
         relationships = {
             'correlations': {},
             'dependencies': {}
         }
         
         # Analyze numeric correlations
-        numeric_cols = df.select_dtypes(include=['number']).columns
         if len(numeric_cols) >= 2:
-            corr_matrix = df[numeric_cols].corr()
+            if corr_matrix is None:
+                corr_matrix = self._fast_corr(df, numeric_cols)
             
-            for i in range(len(numeric_cols)):
-                for j in range(i + 1, len(numeric_cols)):
-                    corr = corr_matrix.iloc[i, j]
-                    if abs(corr) > 0.3:  # Only include significant correlations
-                        relationships['correlations'][f"{numeric_cols[i]}_{numeric_cols[j]}"] = {
-                            'strength': round(corr, 3),
-                            'direction': 'positive' if corr > 0 else 'negative'
-                        }
+            # Only include significant correlations
+            for col_a, col_b, corr in self._correlated_pairs(corr_matrix, 0.3):
+                relationships['correlations'][f"{col_a}_{col_b}"] = {
+                    'strength': round(corr, 3),
+                    'direction': 'positive' if corr > 0 else 'negative'
+                }
+                links['counts'].update((col_a, col_b))
+                links['related'].setdefault(col_a, []).append(col_b)
+                links['related'].setdefault(col_b, []).append(col_a)
         
         # Analyze categorical dependencies
-        categorical_cols = df.select_dtypes(exclude=['number', 'datetime64']).columns
         for col in categorical_cols:
-            for numeric_col in numeric_cols:
-                dependency = self._analyze_categorical_impact(df, col, numeric_col)
+            impacts = self._analyze_categorical_impact(df, col, numeric_cols)
+            for numeric_col, dependency in impacts.items():
                 if dependency['strength'] > 0.1:  # Only include significant dependencies
                     relationships['dependencies'][f"{col}_{numeric_col}"] = dependency
+                    links['counts'].update((col, numeric_col))
         
         return relationships
 
-    def _analyze_categorical_impact(self, df: pd.DataFrame, cat_col: str, num_col: str) -> Dict:
-        """Analyze how categorical variables impact numeric metrics"""
+    def _fast_corr(self, df: pd.DataFrame, cols: pd.Index) -> pd.DataFrame:
+        """Pearson correlation matrix of `cols`, computed as one BLAS product when the block has no NaNs
+
+        DataFrame.corr() runs a pairwise loop to handle missing values; without
+        any, np.corrcoef gives the same matrix far faster on large blocks.
+        """
+        values = df[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        if len(values) < 2 or np.isnan(values).any():
+            return df[cols].corr()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Constant columns come out as NaN, like DataFrame.corr()
+            corr = np.corrcoef(values, rowvar=False)
+        return pd.DataFrame(corr, index=cols, columns=cols)
+
+    def _correlated_pairs(self, corr_matrix: pd.DataFrame, threshold: float) -> List[Tuple[str, str, float]]:
+        """Column pairs from the upper triangle of a correlation matrix with |corr| above threshold"""
+        rows, cols = np.triu_indices(len(corr_matrix.columns), k=1)
+        values = corr_matrix.to_numpy()[rows, cols]
+        mask = np.abs(values) > threshold
+        names = corr_matrix.columns
+        return list(zip(names[rows[mask]], names[cols[mask]], values[mask]))
+
+    def _analyze_categorical_impact(self, df: pd.DataFrame, cat_col: str, num_cols: Sequence[str]) -> Dict[str, Dict]:
+        """Analyze how a categorical variable impacts each numeric metric"""
+        num_cols = list(num_cols)
+        if not num_cols:
+            return {}
         try:
-            # Calculate average metric value for each category
-            group_means = df.groupby(cat_col)[num_col].mean()
-            
+            # Calculate average metric values for each category, grouping once for all
+            # metrics. Only the spread of the means is used, so groups stay unsorted
+            group_means = df.groupby(cat_col, sort=False)[num_cols].mean()
+            spreads = group_means.std()
+            overall_means = df[num_cols].mean()
+        except Exception:
+            return {num_col: {'strength': 0, 'impact': 'error'} for num_col in num_cols}
+
+        impacts = {}
+        for num_col in num_cols:
             # Calculate variation between categories
-            overall_mean = df[num_col].mean()
-            variation = group_means.std() / overall_mean if overall_mean != 0 else 0
-            
-            return {
+            overall_mean = overall_means[num_col]
+            variation = spreads[num_col] / overall_mean if overall_mean != 0 else 0
+            impacts[num_col] = {
                 'strength': round(variation, 3),
                 'impact': 'high' if variation > 0.5 else 'medium' if variation > 0.2 else 'low'
             }
-        except Exception:
-            return {'strength': 0, 'impact': 'error'}
+        return impacts
 
-    def _identify_key_metrics(self, df: pd.DataFrame, relationships: Dict) -> Dict:
+    def _identify_key_metrics(self, df: pd.DataFrame, links: Dict) -> Dict:
         """Identify key metrics based on their relationships and characteristics"""
         key_metrics = {}
         
-        # Count relationships for each metric
+        # Relationship counts and neighbours were collected by _analyze_relationships
         metric_influence = {}
-        for metric in df.columns:
-            correlation_count = sum(1 for k in relationships['correlations'].keys() if metric in k)
-            dependency_count = sum(1 for k in relationships['dependencies'].keys() if metric in k)
-            
-            if pd.api.types.is_numeric_dtype(df[metric]):
-                metric_influence[metric] = {
-                    'relationship_count': correlation_count + dependency_count,
-                    'type': self._determine_metric_type(df[metric]),
-                    'related_metrics': [
-                        k.replace(f"{metric}_", "").replace(f"_{metric}", "")
-                        for k in relationships['correlations'].keys()
-                        if metric in k
-                    ]
-                }
+        numeric = [metric for metric, dtype in df.dtypes.items() if pd.api.types.is_numeric_dtype(dtype)]
+        # Column minimums in one reduction rather than one scan per metric
+        minimums = df[numeric].min()
+        for metric in numeric:
+            metric_influence[metric] = {
+                'relationship_count': links['counts'][metric],
+                'type': self._determine_metric_type(df.dtypes[metric], minimums[metric]),
+                'related_metrics': links['related'].get(metric, [])
+            }
         
         # Select top metrics by influence
         sorted_metrics = sorted(metric_influence.items(), 
@@ -983,10 +1530,10 @@ class AnalyticsEngine:
         
         return key_metrics
 
-    def _determine_metric_type(self, series: pd.Series) -> str:
-        """Determine the type and characteristics of a metric"""
-        if series.min() >= 0:
-            if series.dtype in ['int64', 'int32']:
+    def _determine_metric_type(self, dtype, min_value) -> str:
+        """Determine the type and characteristics of a metric from its dtype and minimum"""
+        if min_value >= 0:
+            if pd.api.types.is_integer_dtype(dtype):
                 return 'count_metric'
             else:
                 return 'continuous_metric'
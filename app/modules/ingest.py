@@ -0,0 +1,297 @@
+import asyncio
+import csv
+import functools
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from starlette.requests import Request
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget, ValueTarget
+
+READ_OPTIONS = pacsv.ReadOptions(block_size=8 << 20, use_threads=True)
+
+# Uploads are parsed on their own pool, so a burst of uploads can't take the
+# default executor's threads; parses beyond the pool wait with their uploads
+# held back by the pipes
+PARSE_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="csv-parse")
+
+# Match pandas, which leaves timestamps as written: Arrow only falls back to
+# its ISO-8601 parser when no formats are given, and no cell matches this one
+NO_TIMESTAMP_PARSERS = ['\x00']
+
+# Match pandas: empty cells in string columns become NaN
+CONVERT_OPTIONS = pacsv.ConvertOptions(strings_can_be_null=True, timestamp_parsers=NO_TIMESTAMP_PARSERS)
+
+# Start of an upload checked for date and time columns before it is parsed
+TEMPORAL_SAMPLE_BYTES = 1 << 20
+
+def _convert_options(column_types: Optional[Dict[str, pa.DataType]],
+                     include_columns: Optional[List[str]] = None) -> pacsv.ConvertOptions:
+    """Conversion options with the given columns typed up front instead of inferred"""
+    if not column_types and not include_columns:
+        return CONVERT_OPTIONS
+    return pacsv.ConvertOptions(strings_can_be_null=True, timestamp_parsers=NO_TIMESTAMP_PARSERS,
+                                column_types=column_types, include_columns=include_columns)
+
+def _text_temporal_columns(sample: bytes) -> Dict[str, pa.DataType]:
+    """Text types for the columns Arrow infers as dates or times in a sample of a CSV
+
+    pandas keeps these as written, and Arrow's values can't always be turned
+    back into the original text (12:30 comes back as 12:30:00).
+    """
+    sample = sample[:sample.rfind(b"\n") + 1]
+    try:
+        schema = pacsv.read_csv(io.BytesIO(sample), convert_options=CONVERT_OPTIONS).schema
+    except pa.ArrowInvalid:
+        return {}
+    return {field.name: pa.string() for field in schema if pa.types.is_temporal(field.type)}
+
+class ChunkPipe:
+    """Blocking file-like reader fed with upload chunks from the event loop
+
+    Chunks pass through a bounded asyncio.Queue: `feed()` only stages them,
+    and the receive loop awaits `drain()`, which waits while the reader is
+    `max_chunks` behind. A slow parse therefore slows the upload down instead
+    of buffering it. Must be created on the event loop that feeds it.
+    """
+
+    def __init__(self, max_chunks: int = 16):
+        self._loop = asyncio.get_running_loop()
+        self._chunks = asyncio.Queue(maxsize=max_chunks)
+        self._staged = []
+        self._pending = []
+        self._pending_size = 0
+        self._finished = False
+        self._eof = False
+        self.closed = False
+
+    def feed(self, chunk: bytes):
+        """Stage a chunk for the reader (called from the event loop)"""
+        if not self.closed:
+            self._staged.append(bytes(chunk))
+
+    def finish(self):
+        """Stage the end of input"""
+        if not self._finished:
+            self._finished = True
+            self._staged.append(None)
+
+    async def drain(self):
+        """Hand the staged chunks to the reader, waiting while it is behind"""
+        staged, self._staged = self._staged, []
+        for chunk in staged:
+            if self.closed:
+                return
+            await self._chunks.put(chunk)
+
+    def _next_chunk(self) -> Optional[bytes]:
+        """Block the reader thread until the event loop delivers a chunk"""
+        chunk = asyncio.run_coroutine_threadsafe(self._chunks.get(), self._loop).result()
+        if chunk is None:
+            self._eof = True
+        return chunk
+
+    def peek(self, size: int) -> bytes:
+        """Block until `size` bytes (or EOF) are available and return them without consuming them"""
+        while not self._eof and self._pending_size < size:
+            chunk = self._next_chunk()
+            if chunk is not None:
+                self._pending.append(chunk)
+                self._pending_size += len(chunk)
+        return b"".join(self._pending)[:size]
+
+    def peek_line(self) -> bytes:
+        """Block until the first line is available and return it without consuming it"""
+        while not self._eof and not any(b"\n" in chunk for chunk in self._pending):
+            chunk = self._next_chunk()
+            if chunk is not None:
+                self._pending.append(chunk)
+                self._pending_size += len(chunk)
+        return b"".join(self._pending).split(b"\n", 1)[0]
+
+    def read(self, size: int = -1):
+        """Block until `size` bytes (or EOF) are available"""
+        while not self._eof and (size < 0 or self._pending_size < size):
+            chunk = self._next_chunk()
+            if chunk is not None:
+                self._pending.append(chunk)
+                self._pending_size += len(chunk)
+
+        # One join per block; the CSV reader wraps the returned buffer
+        # zero-copy, so only the unread tail of the last chunk is copied
+        data = b"".join(self._pending)
+        if 0 <= size < len(data):
+            self._pending = [data[size:]]
+            data = memoryview(data)[:size]
+        else:
+            self._pending = []
+        self._pending_size -= len(data)
+        return data
+
+    def close(self):
+        """Stop accepting chunks, e.g. once the reader has failed
+
+        Queued chunks are dropped so a `drain()` waiting for room returns.
+        """
+        self.closed = True
+        self._loop.call_soon_threadsafe(self._discard)
+
+    def _discard(self):
+        while not self._chunks.empty():
+            self._chunks.get_nowait()
+
+class PipeTarget(BaseTarget):
+    """Forwards the file part of a multipart body into a ChunkPipe, hashing it on the way"""
+
+    def __init__(self, pipe: ChunkPipe):
+        super().__init__()
+        self.pipe = pipe
+        self.received = False
+        self.hash = hashlib.blake2b(digest_size=16)
+
+    def on_data_received(self, chunk: bytes):
+        self.received = True
+        self.hash.update(chunk)
+        self.pipe.feed(chunk)
+
+    def on_finish(self):
+        self.pipe.finish()
+
+def read_csv_stream(source, consumer=None, column_types: Optional[Dict[str, pa.DataType]] = None,
+                    include_columns: Optional[List[str]] = None):
+    """Parse a CSV stream batch by batch
+
+    With a consumer, each batch is handed to `consumer.partial_update()` as soon
+    as it is decoded and dropped afterwards, so memory stays bounded by the
+    block size; the consumer is returned. Otherwise the batches are
+    concatenated into a Table at the end. Columns listed in `column_types`
+    skip type inference; the others are inferred from the first block. With
+    `include_columns`, the other columns are skipped by the tokenizer.
+    Both are keyed by the header names as written in the file.
+
+    The streaming reader fixes the inferred types from the first block and
+    fails on later values that don't fit them (e.g. a "1,200" after plain
+    integers), so consumers should declare their columns in `column_types`.
+    The Table path reads with pacsv.read_csv, which widens types as needed.
+    """
+    convert_options = _convert_options(column_types, include_columns)
+    if consumer is None:
+        table = pacsv.read_csv(source, read_options=READ_OPTIONS, convert_options=convert_options)
+        names = _stripped_names(table.schema)
+        return table if names is None else table.rename_columns(names)
+
+    reader = pacsv.open_csv(source, read_options=READ_OPTIONS, convert_options=convert_options)
+    names = _stripped_names(reader.schema)
+    for batch in reader:
+        consumer.partial_update(batch if names is None else batch.rename_columns(names))
+    return consumer
+
+def _stripped_names(schema: pa.Schema) -> Optional[List[str]]:
+    """Column names with whitespace stripped, or None when they are already clean
+
+    Renaming only rewrites metadata, and is skipped for clean headers.
+    """
+    names = [c.strip() for c in schema.names]
+    return None if names == schema.names else names
+
+def _parse_pipe(pipe: ChunkPipe, consumer=None, column_types=None, columns=None):
+    try:
+        include_columns = None
+        if columns is not None:
+            # Project on the raw header names, which may carry whitespace
+            header = next(csv.reader([pipe.peek_line().decode('utf-8-sig')]), [])
+            include_columns = [name for name in header if name.strip() in columns]
+            if column_types:
+                column_types = {name: column_types[name.strip()]
+                                for name in header if name.strip() in column_types}
+            if not include_columns and header:
+                # An empty projection would parse every column; one text
+                # column still gives the consumer the row count
+                include_columns = header[:1]
+                column_types = {header[0]: pa.string()}
+        if consumer is None:
+            # Keep dates and times as written, typing them as text up front
+            temporal = _text_temporal_columns(pipe.peek(TEMPORAL_SAMPLE_BYTES))
+            if temporal:
+                column_types = {**temporal, **(column_types or {})}
+        return read_csv_stream(pipe, consumer, column_types, include_columns)
+    finally:
+        # Drop any remaining upload bytes instead of buffering them
+        pipe.close()
+
+def missing_fields_error(names: Iterable[str]) -> RequestValidationError:
+    """The 422 error FastAPI raises for required form fields that weren't sent"""
+    return RequestValidationError([
+        {'type': 'missing', 'loc': ('body', name), 'msg': 'Field required', 'input': None}
+        for name in names
+    ])
+
+async def read_multipart_csv(
+    request: Request,
+    fields: Iterable[str],
+    consumer=None,
+    file_field: str = 'file',
+    max_bytes: Optional[int] = None,
+    column_types: Optional[Dict[str, pa.DataType]] = None,
+    columns: Optional[Iterable[str]] = None
+) -> Tuple[Any, Dict[str, Optional[str]], str]:
+    """Parse a multipart upload, decoding the CSV while its bytes are still arriving
+
+    Returns the parsed Table (or `consumer`, see read_csv_stream), the form
+    fields and a content hash of the uploaded file. Bodies larger than
+    `max_bytes` are rejected with a 413, including chunked uploads that don't
+    declare a Content-Length, and a missing file with a 422. When `columns`
+    is given, only those columns (matched after stripping whitespace) are
+    parsed.
+    """
+    try:
+        parser = StreamingFormDataParser(headers=request.headers)
+    except ParseFailedException:
+        # Not a multipart body, so there is no file part either
+        raise missing_fields_error([file_field])
+
+    values = {name: ValueTarget() for name in fields}
+    for name, target in values.items():
+        parser.register(name, target)
+
+    pipe = ChunkPipe()
+    file_target = PipeTarget(pipe)
+    parser.register(file_field, file_target)
+
+    # The CSV reader blocks on the pipe, so it runs in a worker thread
+    parsing = asyncio.get_running_loop().run_in_executor(PARSE_POOL, functools.partial(
+        _parse_pipe, pipe, consumer, column_types,
+        None if columns is None else frozenset(columns)
+    ))
+    try:
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if max_bytes is not None and received > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+            parser.data_received(chunk)
+            await pipe.drain()
+        if not file_target.received:
+            raise missing_fields_error([file_field])
+    except BaseException:
+        pipe.finish()
+        await pipe.drain()
+        await asyncio.gather(parsing, return_exceptions=True)
+        raise
+    pipe.finish()
+    await pipe.drain()
+
+    data = await parsing
+
+    form = {
+        name: target.value.decode('utf-8') or None
+        for name, target in values.items()
+    }
+    return data, form, file_target.hash.hexdigest()
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+import unittest
+from unittest import mock
+
+import httpx
+from fastapi import HTTPException
+from starlette.requests import Request
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import app.main as main
+from app.main import ResultCache, size_guard
+
+
+def request_with(headers):
+    return Request({'type': 'http', 'headers': [(k.encode(), v.encode()) for k, v in headers.items()]})
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(maxsize=2)
+        cache.put('a', {'success': True, 'n': 1})
+        cache.put('b', {'success': True, 'n': 2})
+        self.assertEqual(cache.get('a'), {'success': True, 'n': 1})
+        cache.put('c', {'success': True, 'n': 3})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get('a')['n'], cache.get('c')['n']], [1, 3])
+
+    def test_failed_results_are_not_stored(self):
+        cache = ResultCache()
+        cache.put('a', {'success': False, 'error': 'boom'})
+        cache.put('b', {'error': 'boom'})
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+
+
+class SizeGuardTest(unittest.TestCase):
+    def test_accepts_declared_sizes_up_to_the_limit(self):
+        size_guard(request_with({'content-length': str(main.MAX_UPLOAD_BYTES)}))
+        size_guard(request_with({}))
+
+    def test_rejects_large_uploads(self):
+        with self.assertRaises(HTTPException) as caught:
+            size_guard(request_with({'content-length': str(main.MAX_UPLOAD_BYTES + 1)}))
+        self.assertEqual(caught.exception.status_code, 413)
+
+    def test_rejects_invalid_content_length(self):
+        with self.assertRaises(HTTPException) as caught:
+            size_guard(request_with({'content-length': 'lots'}))
+        self.assertEqual(caught.exception.status_code, 400)
+
+
+class CapacityTest(unittest.IsolatedAsyncioTestCase):
+    CSV = b"a,b\n1,2\n"
+
+    async def test_uploads_beyond_capacity_get_503(self):
+        release = threading.Event()
+
+        def slow_analysis(**kwargs):
+            release.wait(5)
+            return {'success': True, 'value_proposition': kwargs['value_proposition']}
+
+        with mock.patch.object(main, 'analysis_slots', asyncio.Semaphore(1)), \
+                mock.patch.object(main, 'result_cache', ResultCache()), \
+                mock.patch.object(main.analyzer, 'analyze_data_dynamic', slow_analysis):
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                    def post(data):
+                        return client.post('/analyze-dynamic', data=data, files={'file': ('data.csv', self.CSV)})
+
+                    first = asyncio.ensure_future(post({'business_model': 'b', 'value_proposition': 'v1'}))
+                    while not main.analysis_slots.locked():
+                        await asyncio.sleep(0.01)
+                    busy = await post({'business_model': 'b', 'value_proposition': 'v2'})
+                    self.assertEqual(busy.status_code, 503)
+                    self.assertEqual(busy.headers['retry-after'], '10')
+
+                    release.set()
+                    response = await first
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json()['value_proposition'], 'v1')
+
+                    # Rejected requests give their slot back too
+                    self.assertEqual((await post({'business_model': 'b'})).status_code, 422)
+                    with mock.patch.object(main, 'MAX_UPLOAD_BYTES', 10):
+                        self.assertEqual((await post({'business_model': 'b', 'value_proposition': 'v3'})).status_code, 413)
+                    self.assertFalse(main.analysis_slots.locked())
+                    response = await post({'business_model': 'b', 'value_proposition': 'v3'})
+                    self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
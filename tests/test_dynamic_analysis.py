@@ -0,0 +1,60 @@
+import json
+import os
+import types
+import unittest
+
+import pandas as pd
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.modules.analyzer import AnalyticsEngine
+
+
+def fake_client(*replies):
+    """An OpenAI client stand-in returning the given JSON replies in order"""
+    replies = iter(replies)
+
+    def create(**request):
+        message = types.SimpleNamespace(content=json.dumps(next(replies)))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    completions = types.SimpleNamespace(create=create)
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+
+
+class DynamicAnalysisResultsTest(unittest.TestCase):
+    PLAN = {'metrics': [
+        {'name': 'first revenues', 'code': "result = df['REV'].values[:3]"},
+        {'name': 'all positive', 'code': "result = (df['REV'] > 0).all()"},
+    ]}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = AnalyticsEngine()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.background.shutdown()
+
+    def analyze(self, questions=None):
+        reply = {'answers': [{'answer': 'a'}]} if questions else {'recommendations': [{'recommendation': 'r'}]}
+        self.engine.client = fake_client(self.PLAN, reply)
+        df = pd.DataFrame({'rev': [1.5, 2.0, 3.25, 4.0], 'week': ['2024-01-01'] * 4})
+        return self.engine.analyze_data_dynamic(df, 'saas', 'insight', questions=questions)
+
+    def assert_plain_results(self, result):
+        self.assertTrue(result['success'], result.get('error'))
+        analysis = result['data']['analysis']
+        self.assertEqual(analysis['first revenues'], [1.5, 2.0, 3.25])
+        self.assertIs(analysis['all positive'], True)
+        json.dumps(result)
+
+    def test_recommendations_with_array_and_bool_results(self):
+        self.assert_plain_results(self.analyze())
+
+    def test_answers_with_array_and_bool_results(self):
+        self.assert_plain_results(self.analyze(questions=['q']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import asyncio
+import io
+import unittest
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from starlette.requests import Request
+
+from app.modules import ingest
+from app.modules.analyzer import SummaryAccumulator
+
+BOUNDARY = 'test-boundary'
+
+
+def multipart_body(fields, file_bytes=None):
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    if file_bytes is not None:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="data.csv"\r\n'
+                     f'Content-Type: text/csv\r\n\r\n'.encode() + file_bytes + b'\r\n')
+    return b''.join(parts) + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def request_for(body, chunk_size=7):
+    """A Request delivering the body in small chunks, as a slow upload would"""
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in chunks]
+    messages.append({'type': 'http.request', 'body': b'', 'more_body': False})
+
+    async def receive():
+        return messages.pop(0)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/', 'query_string': b'',
+             'headers': [(b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode())]}
+    return Request(scope, receive)
+
+
+def read(body, **kwargs):
+    return asyncio.run(ingest.read_multipart_csv(request_for(body), ['business_model'], **kwargs))
+
+
+class ChunkPipeTest(unittest.IsolatedAsyncioTestCase):
+    async def fed(self, *chunks):
+        pipe = ingest.ChunkPipe()
+        for chunk in chunks:
+            pipe.feed(chunk)
+        pipe.finish()
+        await pipe.drain()
+        return pipe
+
+    async def test_peek_line_does_not_consume(self):
+        pipe = await self.fed(b'a,', b'b\n1,', b'2\n')
+        self.assertEqual(await asyncio.to_thread(pipe.peek_line), b'a,b')
+        self.assertEqual(bytes(await asyncio.to_thread(pipe.read)), b'a,b\n1,2\n')
+
+    async def test_peek_line_without_newline(self):
+        self.assertEqual(await asyncio.to_thread((await self.fed(b'a,b')).peek_line), b'a,b')
+        self.assertEqual(await asyncio.to_thread((await self.fed()).peek_line), b'')
+
+    async def test_read_sizes_and_eof(self):
+        pipe = await self.fed(b'abc', b'defg')
+        for size, expected in [(2, b'ab'), (4, b'cdef'), (10, b'g'), (10, b'')]:
+            self.assertEqual(bytes(await asyncio.to_thread(pipe.read, size)), expected)
+
+    async def test_read_blocks_until_fed(self):
+        pipe = ingest.ChunkPipe()
+        reading = asyncio.ensure_future(asyncio.to_thread(pipe.read, 4))
+        pipe.feed(b'ab')
+        await pipe.drain()
+        await asyncio.sleep(0.05)
+        self.assertFalse(reading.done())
+        pipe.feed(b'cd')
+        await pipe.drain()
+        self.assertEqual(bytes(await reading), b'abcd')
+
+    async def test_drain_waits_for_the_reader(self):
+        pipe = ingest.ChunkPipe(max_chunks=2)
+        for chunk in (b'a', b'b', b'c', b'd'):
+            pipe.feed(chunk)
+        draining = asyncio.ensure_future(pipe.drain())
+        await asyncio.sleep(0.05)
+        self.assertFalse(draining.done())
+        self.assertEqual(bytes(await asyncio.to_thread(pipe.read, 2)), b'ab')
+        await asyncio.wait_for(draining, timeout=5)
+
+    async def test_close_releases_a_waiting_drain(self):
+        pipe = ingest.ChunkPipe(max_chunks=1)
+        for chunk in (b'a', b'b', b'c'):
+            pipe.feed(chunk)
+        draining = asyncio.ensure_future(pipe.drain())
+        await asyncio.sleep(0.05)
+        self.assertFalse(draining.done())
+        await asyncio.to_thread(pipe.close)
+        await asyncio.wait_for(draining, timeout=5)
+
+    async def test_closed_pipe_drops_chunks(self):
+        pipe = ingest.ChunkPipe()
+        pipe.close()
+        pipe.feed(b'abc')
+        await pipe.drain()
+        self.assertTrue(pipe._chunks.empty())
+
+
+class ReadCsvStreamTest(unittest.TestCase):
+    def setUp(self):
+        # Small blocks, so values after the first one must fit the inferred types
+        self.read_options = ingest.READ_OPTIONS
+        ingest.READ_OPTIONS = pacsv.ReadOptions(block_size=64)
+
+    def tearDown(self):
+        ingest.READ_OPTIONS = self.read_options
+
+    def csv_with_late_values(self):
+        rows = ['week,views,clicks']
+        for i in range(40):
+            views = '"1,200"' if i == 30 else str(i)
+            clicks = '' if i < 20 else '2'
+            rows.append(f'{i + 1},{views},{clicks}')
+        return ('\n'.join(rows) + '\n').encode()
+
+    def test_table_widens_types_after_the_first_block(self):
+        table = ingest.read_csv_stream(io.BytesIO(self.csv_with_late_values()))
+        self.assertEqual(table.num_rows, 40)
+        self.assertEqual(table.column('views').type, pa.string())
+
+    def test_summary_reads_late_values(self):
+        summary = ingest.read_csv_stream(io.BytesIO(self.csv_with_late_values()), SummaryAccumulator(),
+                                         SummaryAccumulator.COLUMN_TYPES).finalize()
+        self.assertEqual(summary['metrics']['total_views'], sum(range(40)) - 30 + 1200)
+        self.assertEqual(summary['metrics']['total_clicks'], 40.0)
+        self.assertEqual(summary['date_range'], {'start': 1, 'end': 40})
+
+    def test_header_names_are_stripped(self):
+        table = ingest.read_csv_stream(io.BytesIO(b' week , views\n1,2\n'))
+        self.assertEqual(table.column_names, ['week', 'views'])
+
+
+class ReadMultipartCsvTest(unittest.TestCase):
+    CSV = b' week ,views,extra\n2024-01-01,"1,200",x\n2024-01-08,3,y\n'
+
+    def test_table_form_and_hash(self):
+        table, form, digest = read(multipart_body({'business_model': 'saas'}, self.CSV))
+        self.assertEqual(table.column_names, ['week', 'views', 'extra'])
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(form, {'business_model': 'saas'})
+        self.assertEqual(len(digest), 32)
+
+    def test_dates_and_times_keep_their_text(self):
+        data = (b'week,at,utc,time,n\n'
+                b'2024-01-01,2024-01-01 10:00,2024-01-01T10:00:00Z,12:30,1\n'
+                b'2024-01-08,2024-01-08 11:00,2024-01-08T11:00:00Z,13:45,2\n')
+        table, _, _ = read(multipart_body({'business_model': 'saas'}, data))
+        self.assertEqual(table.to_pylist()[0], {'week': '2024-01-01', 'at': '2024-01-01 10:00',
+                                                'utc': '2024-01-01T10:00:00Z', 'time': '12:30', 'n': 1})
+
+    def test_missing_field_is_none(self):
+        _, form, _ = read(multipart_body({}, self.CSV))
+        self.assertEqual(form, {'business_model': None})
+
+    def test_projection_with_peeked_header(self):
+        summary, _, _ = read(multipart_body({'business_model': 'saas'}, self.CSV),
+                             consumer=SummaryAccumulator(),
+                             column_types=SummaryAccumulator.COLUMN_TYPES,
+                             columns=SummaryAccumulator.COLUMNS)
+        self.assertEqual(summary.columns, ['week', 'views'])
+        result = summary.finalize()
+        self.assertEqual(result['metrics']['total_views'], 1203.0)
+        self.assertEqual(result['date_range'], {'start': '2024-01-01', 'end': '2024-01-08'})
+
+    def test_projection_without_matching_columns(self):
+        # A late value that doesn't fit the first block's types must not
+        # matter when none of the columns are read
+        self.addCleanup(setattr, ingest, 'READ_OPTIONS', ingest.READ_OPTIONS)
+        ingest.READ_OPTIONS = pacsv.ReadOptions(block_size=64)
+        data = b'foo,bar\n' + b'1,2\n' * 50 + b'x,y\n'
+        summary, _, _ = read(multipart_body({'business_model': 'saas'}, data),
+                             consumer=SummaryAccumulator(),
+                             column_types=SummaryAccumulator.COLUMN_TYPES,
+                             columns=SummaryAccumulator.COLUMNS)
+        self.assertEqual(summary.finalize(), {'total_records': 51, 'metrics': {}})
+
+    def test_upload_over_limit_is_rejected(self):
+        with self.assertRaises(HTTPException) as raised:
+            read(multipart_body({'business_model': 'saas'}, self.CSV * 20), max_bytes=200)
+        self.assertEqual(raised.exception.status_code, 413)
+
+    def test_missing_file(self):
+        with self.assertRaises(RequestValidationError) as raised:
+            read(multipart_body({'business_model': 'saas'}))
+        self.assertEqual([error['loc'] for error in raised.exception.errors()], [('body', 'file')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.modules.analyzer import AnalyticsEngine, MetricOps, clean_result
+
+
+class MetricOpsTest(unittest.TestCase):
+    DF = pd.DataFrame({
+        'WIDGET': ['a', 'a', 'b', 'c'],
+        'VIEWS': [100, 300, 50, 0],
+        'CLICKS': [10, 20, 5, 0],
+    })
+
+    def run_op(self, op, **args):
+        _, runner, loads, stores = MetricOps.build(op, args)
+        self.assertEqual((loads, stores), ({'df'}, set()))
+        return runner(self.DF)
+
+    def test_column_arguments_are_upper_cased(self):
+        self.assertEqual(self.run_op('sum', column='views'), 450)
+        self.assertEqual(self.run_op('groupby_sum', by=['widget'], column='clicks').to_dict(),
+                         {'a': 30, 'b': 5, 'c': 0})
+
+    def test_other_arguments_are_passed_through(self):
+        self.assertEqual(self.run_op('quantile', column='views', q=0.5), 75.0)
+        self.assertEqual(self.run_op('value_counts', column='widget', normalize=True)['a'], 0.5)
+
+    def test_ratio(self):
+        self.assertEqual(self.run_op('ratio', numerator='clicks', denominator='views'), 35 / 450)
+        self.assertEqual(MetricOps._ratio(5, 0), 0)
+
+    def test_group_ratio_is_zero_for_empty_groups(self):
+        ratio = self.run_op('groupby_ratio', by='widget', numerator='clicks', denominator='views')
+        self.assertEqual(ratio.to_dict(), {'a': 0.075, 'b': 0.1, 'c': 0.0})
+
+    def test_unknown_op(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown metric op: drop'):
+            MetricOps.build('drop', {'column': 'views'})
+
+    def test_unknown_argument_fails_when_run(self):
+        _, runner, _, _ = MetricOps.build('sum', {'col': 'views'})
+        with self.assertRaises(TypeError):
+            runner(self.DF)
+
+
+class CleanResultTest(unittest.TestCase):
+    def test_scalars(self):
+        self.assertEqual(clean_result(float('nan')), 0)
+        self.assertEqual(clean_result(np.float64('inf')), 0)
+        self.assertEqual(clean_result(1.5), 1.5)
+        value = clean_result(np.int64(3))
+        self.assertEqual((value, type(value)), (3, int))
+
+    def test_nested_containers(self):
+        self.assertEqual(clean_result({'a': [float('nan'), 2.0], 'b': {'c': np.int64(1)}}),
+                         {'a': [0, 2.0], 'b': {'c': 1}})
+
+    def test_float_series(self):
+        series = pd.Series([1.5, np.nan, np.inf], index=['a', 'b', 'c'])
+        self.assertEqual(clean_result(series), {'a': 1.5, 'b': 0.0, 'c': 0.0})
+
+    def test_mixed_series(self):
+        self.assertEqual(clean_result(pd.Series([1, None, 'x'], index=['a', 'b', 'c'])),
+                         {'a': 1, 'b': 0, 'c': 'x'})
+
+    def test_float_frame(self):
+        frame = pd.DataFrame({'a': [1.0, np.nan], 'b': [-np.inf, 2.0]})
+        self.assertEqual(clean_result(frame), [{'a': 1.0, 'b': 0.0}, {'a': 0.0, 'b': 2.0}])
+
+    def test_mixed_frame(self):
+        frame = pd.DataFrame({'name': ['x', 'y'], 'value': [np.inf, 2.0]})
+        self.assertEqual(clean_result(frame), [{'name': 'x', 'value': 0.0}, {'name': 'y', 'value': 2.0}])
+
+
+class PercentileRangesTest(unittest.TestCase):
+    RANGES = [(0, 1), (1, 5), (5, 10), (10, 25), (25, 50), (50, 100)]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = AnalyticsEngine()
+        rng = np.random.default_rng(0)
+        entities = [f'c{i}' for i in range(2000)]
+        cls.df = pd.DataFrame({
+            'CUSTOMER_ID': np.repeat(entities, 2),
+            'ACCOUNT_PLAN': rng.choice(['free', 'pro', 'ent'], 4000),
+            'WIDGET_VIEWS': rng.integers(0, 1000, 4000),
+        })
+        # Rounded so that several entities share the breakpoint values and
+        # the lowest range, (0th, 1st percentile], comes out empty
+        cls.series = pd.Series(rng.gamma(2.0, 3.0, 2000).round(), index=pd.Index(entities, name='CUSTOMER_ID'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.background.shutdown()
+
+    def expected(self, series, entities_of):
+        """Ranges computed one mask at a time: values in (lower, upper]"""
+        results = {}
+        for start, end in self.RANGES:
+            lower, upper = np.percentile(series, start), np.percentile(series, end)
+            in_range = series[(series > lower) & (series <= upper)]
+            if len(in_range) == 0:
+                continue
+            results[f"top_{end}%" if start == 0 else f"{start}%_to_{end}%"] = {
+                'min': float(in_range.min()), 'max': float(in_range.max()),
+                'sample_size': len(in_range),
+                'characteristics': self.engine._get_range_characteristics(entities_of(in_range.index)),
+            }
+        return results
+
+    def actual(self, series, entity_col):
+        results = self.engine._analyze_series_by_percentiles(series, self.df, entity_col)
+        return {name: {'min': r['metric_stats']['min'], 'max': r['metric_stats']['max'],
+                       'sample_size': r['sample_size'], 'characteristics': r['characteristics']}
+                for name, r in results.items()}
+
+    def test_ranges_by_entity_column(self):
+        expected = self.expected(self.series, lambda ids: self.df[self.df['CUSTOMER_ID'].isin(ids)])
+        self.assertEqual(self.actual(self.series, 'CUSTOMER_ID'), expected)
+        self.assertNotIn('top_1%', expected)
+
+    def test_ranges_with_repeated_entities(self):
+        series = pd.concat([self.series, self.series.iloc[:10]])
+        expected = self.expected(series, lambda ids: self.df[self.df['CUSTOMER_ID'].isin(ids)])
+        self.assertEqual(self.actual(series, 'CUSTOMER_ID'), expected)
+
+    def test_ranges_by_row_index(self):
+        series = pd.Series(self.df['WIDGET_VIEWS'].to_numpy() * 1.5)
+        expected = self.expected(series, lambda rows: self.df.loc[self.df.index.isin(rows)])
+        self.assertEqual(self.actual(series, 'Entity'), expected)
+
+    def test_large_results_switch_to_ranges(self):
+        converted, result = self.engine._check_and_convert_large_result(self.series, self.df)
+        self.assertTrue(converted)
+        self.assertIn('50%_to_100%', result)
+        converted, result = self.engine._check_and_convert_large_result(self.series.head(10), self.df)
+        self.assertFalse(converted)
+        self.assertTrue(result.equals(self.series.head(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
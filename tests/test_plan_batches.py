@@ -0,0 +1,120 @@
+import os
+import unittest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from app.modules.analyzer import AnalyticsEngine, CodeValidator
+
+
+class NamesUsedTest(unittest.TestCase):
+    def test_reads_and_assignments(self):
+        loads, stores = CodeValidator.names_used("total = df['VIEWS'].sum()\nresult = total / 2")
+        self.assertEqual(loads, {'df', 'total'})
+        self.assertEqual(stores, {'total'})
+
+    def test_column_assignment_writes_df(self):
+        _, stores = CodeValidator.names_used("df['CTR'] = df['CLICKS'] / df['VIEWS']")
+        self.assertIn('df', stores)
+
+    def test_loc_assignment_writes_df(self):
+        _, stores = CodeValidator.names_used("df.loc[df['VIEWS'] < 0, 'VIEWS'] = 0")
+        self.assertIn('df', stores)
+
+    def test_del_writes_df(self):
+        _, stores = CodeValidator.names_used("del df['VIEWS']")
+        self.assertIn('df', stores)
+
+    def test_inplace_call_writes_df(self):
+        _, stores = CodeValidator.names_used("df.fillna(0, inplace=True)")
+        self.assertIn('df', stores)
+
+    def test_mutating_methods_write_df(self):
+        for code in ("df.insert(0, 'A', 1)", "df.pop('VIEWS')", "df.update(other)"):
+            with self.subTest(code=code):
+                _, stores = CodeValidator.names_used(code)
+                self.assertIn('df', stores)
+
+    def test_copies_do_not_write_df(self):
+        _, stores = CodeValidator.names_used("clean = df.dropna()\nclean['A'] = 1")
+        self.assertEqual(stores, {'clean'})
+
+    def test_alias_writes_df(self):
+        _, stores = CodeValidator.names_used("d = df\nd['A'] = 1")
+        self.assertIn('df', stores)
+
+    def test_chained_and_tuple_aliases_write_df(self):
+        for code in ("a = df\nb = a\nb.drop(columns=['A'], inplace=True)",
+                     "d, n = df, 3\nd.loc[0, 'A'] = n"):
+            with self.subTest(code=code):
+                _, stores = CodeValidator.names_used(code)
+                self.assertIn('df', stores)
+
+    def test_alias_without_mutation_only_writes_alias(self):
+        _, stores = CodeValidator.names_used("d = df\nresult = d['VIEWS'].sum()")
+        self.assertEqual(stores, {'d'})
+
+    def test_comprehension_variables_and_result_are_ignored(self):
+        loads, stores = CodeValidator.names_used("result = {c: df[c].sum() for c in df.columns}")
+        self.assertEqual(loads, {'df'})
+        self.assertEqual(stores, set())
+
+
+class PlanBatchesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = AnalyticsEngine()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.background.shutdown()
+
+    def batch_names(self, *metrics):
+        batches = self.engine._plan_batches([{'name': name, 'code': code} for name, code in metrics])
+        for batch in batches:
+            for metric, code in batch:
+                self.assertNotIsInstance(code, Exception, metric['name'])
+        return [[metric['name'] for metric, _ in batch] for batch in batches]
+
+    def test_independent_reads_share_a_batch(self):
+        self.assertEqual(self.batch_names(('views', "df['VIEWS'].sum()"),
+                                          ('clicks', "df['CLICKS'].sum()")),
+                         [['views', 'clicks']])
+
+    def test_read_after_write_starts_a_batch(self):
+        self.assertEqual(self.batch_names(('ctr', "df['CTR'] = df['CLICKS'] * 100\ndf['CTR'].max()"),
+                                          ('views', "df['VIEWS'].sum()")),
+                         [['ctr'], ['views']])
+
+    def test_write_after_read_starts_a_batch(self):
+        self.assertEqual(self.batch_names(('views', "df['VIEWS'].sum()"),
+                                          ('clean', "df.dropna(inplace=True)\nlen(df)")),
+                         [['views'], ['clean']])
+
+    def test_write_through_alias_starts_a_batch(self):
+        self.assertEqual(self.batch_names(('views', "df['VIEWS'].sum()"),
+                                          ('ctr', "d = df\nd['CTR'] = d['CLICKS'] * 100\nd['CTR'].max()")),
+                         [['views'], ['ctr']])
+
+    def test_reading_an_earlier_metric_starts_a_batch(self):
+        self.assertEqual(self.batch_names(('total views', "df['VIEWS'].sum()"),
+                                          ('half', "total_views / 2")),
+                         [['total views'], ['half']])
+
+    def test_shared_helper_name_starts_a_batch(self):
+        self.assertEqual(self.batch_names(('a', "tmp = df['VIEWS']\ntmp.sum()"),
+                                          ('b', "tmp = df['CLICKS']\ntmp.sum()")),
+                         [['a'], ['b']])
+
+    def test_ops_and_rejected_code_stay_in_the_batch(self):
+        batches = self.engine._plan_batches([
+            {'name': 'views', 'op': 'sum', 'args': {'column': 'views'}},
+            {'name': 'bad', 'code': "import os"},
+            {'name': 'clicks', 'code': "df['CLICKS'].sum()"},
+        ])
+        self.assertEqual([[metric['name'] for metric, _ in batch] for batch in batches],
+                         [['views', 'bad', 'clicks']])
+        self.assertIsInstance(batches[0][1][1], Exception)
+
+
+if __name__ == '__main__':
+    unittest.main()